@@ -110,7 +110,7 @@ if example == 1 or example == 3:
             # axarr[axj, axi].set_aspect(5)
             axarr[axj, axi].set_ylabel('State ' + str(ri), fontsize=12)
             axarr[axj, axi].set_xlabel("Time")
-            axarr[axj, axi].plot(times[1:], curves[rf], label="RI=%d" % (rf,))
+            axarr[axj, axi].plot(times, curves[rf], label="RI=%d" % (rf,))
             # axarr[axj, axi].set_xticks(range(10), minor=False)
             axarr[axj, axi].set_yticks(np.linspace(0, 1, 5), minor=False)
             # axarr[axj, axi].yaxis.grid(True, which='minor')
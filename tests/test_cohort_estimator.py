@@ -12,19 +12,68 @@
 # either express or implied. See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
+import json
+import pickle
+import tempfile
 import unittest
 
+import numpy as np
 import pandas as pd
 
 import transitionMatrix as tm
 from transitionMatrix import source_path
+from transitionMatrix.estimators import bayesian_estimator as ba
+from transitionMatrix.estimators import bootstrap as bs
+from transitionMatrix.estimators import cache as ca
 from transitionMatrix.estimators import cohort_estimator as es
+from transitionMatrix.estimators import parallel as pl
+from transitionMatrix.estimators import rolling_estimator as ro
+from transitionMatrix.estimators import simple_estimator as ss
 
 ACCURATE_DIGITS = 2
 
 
 class TestSimpleEstimator(unittest.TestCase):
-    pass
+    """
+    Test the single period estimator against pandas crosstab counts
+
+    """
+
+    def test_simple_estimator(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data7.csv')
+        definition = [(str(s), str(s)) for s in range(8)]
+        myState = tm.StateSpace(definition)
+        myEstimator = ss.SimpleEstimator(states=myState, ci={'method': 'goodman', 'alpha': 0.05})
+        result = myEstimator.fit(data)
+        expected = pd.crosstab(data['From'], data['To'], normalize='index')
+        for s1 in expected.index:
+            for s2 in expected.columns:
+                self.assertAlmostEqual(result[0][s1, s2], expected.loc[s1, s2], places=ACCURATE_DIGITS)
+        self.assertEqual(myEstimator.counts, len(data))
+
+        data['Balance'] = np.where(data['To'] == data['From'], 1.0, 3.0)
+        labels = {'ID': 'ID', 'From': 'From', 'To': 'To', 'Weight': 'Balance'}
+        weightedEstimator = ss.SimpleEstimator(states=myState)
+        weighted = weightedEstimator.fit(data, labels=labels)
+        expected = pd.crosstab(data['From'], data['To'], values=data['Balance'], aggfunc='sum',
+                               normalize='index').fillna(0.0)
+        for s1 in expected.index:
+            for s2 in expected.columns:
+                self.assertAlmostEqual(weighted[0][s1, s2], expected.loc[s1, s2], places=ACCURATE_DIGITS)
+        self.assertEqual(weightedEstimator.counts, data['Balance'].sum())
+
+        arrayEstimator = ss.SimpleEstimator(states=myState)
+        arrayEstimator.fit_arrays(data['From'].to_numpy(), data['To'].to_numpy(), weight=data['Balance'].to_numpy())
+        self.assertTrue(np.allclose(arrayEstimator.matrix_set[0], weighted[0]))
+        # confidence intervals are based on the event counts, negative weights are rejected
+        weightedEstimator = ss.SimpleEstimator(states=myState, ci={'method': 'goodman', 'alpha': 0.05})
+        weightedEstimator.fit(data, labels=labels)
+        self.assertTrue(np.allclose(weightedEstimator.confint_lower, myEstimator.confint_lower))
+        self.assertTrue(np.allclose(weightedEstimator.confint_upper, myEstimator.confint_upper))
+        data['Balance'] = data['Balance'] - 2.0
+        self.assertRaises(ValueError, weightedEstimator.fit, data, labels=labels)
 
 
 class TestCohortEstimator(unittest.TestCase):
@@ -79,3 +128,352 @@ class TestCohortEstimator(unittest.TestCase):
         self.assertAlmostEqual(am[2, 0], 0.0, places=ACCURATE_DIGITS, msg=None, delta=None)
         self.assertAlmostEqual(am[2, 1], 0.0, places=ACCURATE_DIGITS, msg=None, delta=None)
         self.assertAlmostEqual(am[2, 2], 1.0, places=ACCURATE_DIGITS, msg=None, delta=None)
+
+    def test_cohort_estimator_bootstrap(self):
+        """
+        Test that entity bootstrap replicates are reproducible and independent of the number of workers
+
+        """
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        samples = bs.entity_bootstrap(myEstimator, sorted_data, replicates=20, workers=1, seed=42, batch_size=8)
+        parallel_samples = bs.entity_bootstrap(myEstimator, sorted_data, replicates=20, workers=2, seed=42,
+                                               batch_size=8)
+        self.assertEqual(samples.shape, (20, 3, 3, 4))
+        self.assertTrue((samples == parallel_samples).all())
+        lower, upper = bs.bootstrap_confint(samples, alpha=0.05)
+        self.assertLess(lower[0, 0, 0], 0.8)
+        self.assertGreater(upper[0, 0, 0], 0.8)
+        cumulative = bs.entity_bootstrap(myEstimator, sorted_data, replicates=5, workers=1, seed=42,
+                                         statistic=bs.cumulative_matrices)
+        self.assertAlmostEqual(cumulative[0, 0, :, -1].sum(), 1.0, places=ACCURATE_DIGITS)
+
+    def test_cohort_estimator_missing_values(self):
+        """
+        Test that rows with missing state or time are counted as nans and do not contribute to counts
+
+        """
+        data = pd.DataFrame({'Entity': [0, 0, 0, 1, 1, 2, 2],
+                             'Period': [0, 1, 2, 0, 1, 0, None],
+                             'Rating': [0, 1, 1, 1, None, 0, 0]})
+        definition = [('0', "Stage 1"), ('1', "Stage 2")]
+        myState = tm.StateSpace(definition)
+        labels = {'ID': 'Entity', 'Time': 'Period', 'State': 'Rating'}
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2])
+        myEstimator.fit(data, labels=labels)
+        self.assertEqual(myEstimator.nans, 2)
+        self.assertEqual(myEstimator.counts, 5)
+        self.assertEqual(myEstimator.count_set[0][0, 1], 1)
+        self.assertEqual(myEstimator.matrix_set[0][0, 1], 0.5)
+        # the last event has no migration when its previous observation is missing
+        data = pd.DataFrame({'Entity': [0, 0, 1, 1, 1],
+                             'Period': [0, 1, 0, 1, 2],
+                             'Rating': [1, 0, 0, None, 1]})
+        myEstimator.fit(data, labels=labels)
+        self.assertEqual(myEstimator.nans, 1)
+        self.assertEqual(myEstimator.transition_counts.migrations.sum(), 1)
+        self.assertEqual(myEstimator.transition_counts.migrations[1, 0, 0], 1)
+        # the last event cannot be at the first timepoint
+        data = pd.DataFrame({'Entity': [0, 0, 1], 'Period': [0, 1, 0], 'Rating': [1, 0, 0]})
+        self.assertRaises(ValueError, myEstimator.fit, data, labels=labels)
+
+    def test_cohort_estimator_partial_fit(self):
+        """
+        Test that accumulating counts over chunks of data reproduces the in-memory estimate
+
+        """
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        myEstimator.fit(sorted_data)
+        chunkEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        for start in range(0, len(sorted_data), 997):
+            chunkEstimator.partial_fit(sorted_data.iloc[start:start + 997])
+        chunkEstimator.finalize()
+        self.assertEqual(myEstimator.counts, chunkEstimator.counts)
+        for k in range(4):
+            self.assertTrue((myEstimator.count_set[k] == chunkEstimator.count_set[k]).all())
+            self.assertTrue((myEstimator.matrix_set[k] == chunkEstimator.matrix_set[k]).all())
+        # empty chunks (e.g. fully filtered) do not affect the estimate
+        emptyEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        emptyEstimator.partial_fit(sorted_data.iloc[:0])
+        emptyEstimator.partial_fit(sorted_data.iloc[:500])
+        emptyEstimator.partial_fit(sorted_data.iloc[:0])
+        emptyEstimator.partial_fit(sorted_data.iloc[500:])
+        emptyEstimator.partial_fit(sorted_data.iloc[:0])
+        emptyEstimator.finalize()
+        self.assertEqual(emptyEstimator.transition_counts, myEstimator.transition_counts)
+
+    def test_cohort_estimator_sharded(self):
+        """
+        Test that counting hash partitions of the entities in parallel reproduces the in-memory estimate
+
+        """
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        myEstimator.fit(sorted_data)
+        shardEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        pl.sharded_fit(shardEstimator, sorted_data, workers=2, shards=4)
+        self.assertEqual(myEstimator.transition_counts, shardEstimator.transition_counts)
+        self.assertEqual(myEstimator.counts, shardEstimator.counts)
+        for k in range(4):
+            self.assertTrue((myEstimator.matrix_set[k] == shardEstimator.matrix_set[k]).all())
+
+    def test_cohort_estimator_fit_arrays(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        myEstimator.fit(sorted_data)
+        arrayEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        # buffer protocol inputs
+        event_time = array.array('d', sorted_data['Time'].astype(float))
+        arrayEstimator.fit_arrays(sorted_data['ID'].to_numpy(), memoryview(event_time),
+                                  sorted_data['State'].to_numpy())
+        self.assertEqual(arrayEstimator.transition_counts, myEstimator.transition_counts)
+        # numeric inputs are not copied
+        event_arrays = arrayEstimator._encode_events(sorted_data['ID'].to_numpy(), event_time,
+                                                     sorted_data['State'].to_numpy())
+        self.assertTrue(np.shares_memory(event_arrays[2], np.frombuffer(event_time)))
+
+    def test_cohort_estimator_instrumentation(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        records = []
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4],
+                                         ci={'method': 'goodman', 'alpha': 0.05})
+        myEstimator.instrument(memory=True, callback=lambda record: records.append(record))
+        myEstimator.fit(sorted_data)
+        stats = myEstimator.fit_stats
+        self.assertEqual(records, [stats])
+        self.assertEqual(stats['method'], 'fit')
+        self.assertEqual([phase['name'] for phase in stats['phases']],
+                         ['ingestion', 'counting', 'counting', 'normalization', 'confidence'])
+        self.assertEqual(stats['phases'][0]['rows'], len(data))
+        self.assertTrue(stats['peak_memory'] > 0)
+        self.assertTrue(stats['seconds'] >= sum(phase['seconds'] for phase in stats['phases']))
+        # the instrumentation is not pickled
+        copy = pickle.loads(pickle.dumps(myEstimator))
+        copy.fit(sorted_data)
+        self.assertEqual(len(records), 1)
+        self.assertIsNone(es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4]).fit_stats)
+
+    def test_cohort_estimator_segments(self):
+        """
+        Test that the single pass segment estimation reproduces separate fits per segment
+
+        """
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        sorted_data['Segment'] = sorted_data['ID'] % 3
+        labels = {'ID': 'ID', 'Time': 'Time', 'State': 'State', 'Segment': 'Segment'}
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        result = myEstimator.fit(sorted_data, labels=labels)
+        self.assertEqual(result.shape, (3, 4, 3, 3))
+        for segment, segment_data in sorted_data.groupby('Segment'):
+            segmentEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+            segmentEstimator.fit(segment_data)
+            self.assertEqual(segmentEstimator.transition_counts, myEstimator.segment_transition_counts(segment))
+            for k in range(4):
+                self.assertTrue((segmentEstimator.matrix_set[k] == result[segment, k]).all())
+        # a segment ending with an observation at the first timepoint is rejected (as by separate fits)
+        data = pd.DataFrame({'ID': [0, 0, 0, 0, 0, 1, 2, 2, 3],
+                             'Time': [0, 1, 2, 3, 4, 0, 2, 3, 3],
+                             'State': [1, 0, 0, 2, 0, 0, 0, 0, 0],
+                             'Segment': [0, 0, 0, 0, 0, 1, 2, 2, 0]})
+        self.assertRaises(ValueError, myEstimator.fit, data, labels=labels)
+        self.assertRaises(ValueError, es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4]).fit,
+                          data[data['Segment'] == 1])
+
+    def test_cohort_estimator_assign_cohorts(self):
+        """
+        Test that assigning real valued and datetime observation times to cohorts reproduces the bin_timestamps estimate
+
+        """
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data3.csv')
+        definition = [(str(s), "Stage " + str(s + 1)) for s in range(7)]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        cohort_data, cohort_bounds = tm.utils.bin_timestamps(sorted_data, cohorts=4)
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=cohort_bounds)
+        myEstimator.fit(cohort_data)
+        timeEstimator = es.CohortEstimator(states=myState, cohort_bounds=cohort_bounds, assign_cohorts=True)
+        timeEstimator.fit(sorted_data)
+        self.assertEqual(myEstimator.transition_counts, timeEstimator.transition_counts)
+
+        origin = pd.Timestamp('2020-01-01')
+        sorted_data['Time'] = origin + pd.to_timedelta(sorted_data['Time'], unit='D')
+        date_bounds = [origin + pd.Timedelta(days=b) for b in cohort_bounds]
+        dateEstimator = es.CohortEstimator(states=myState, cohort_bounds=date_bounds, assign_cohorts=True)
+        dateEstimator.fit(sorted_data)
+        self.assertEqual(myEstimator.transition_counts, dateEstimator.transition_counts)
+
+    def test_cohort_estimator_cache(self):
+        """
+        Test that a repeated estimation is loaded from the result cache
+
+        """
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ca.ResultCache(directory, max_entries=1)
+            myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4], ci={'method': 'goodman', 'alpha': 0.05})
+            result = cache.fit(myEstimator, sorted_data)
+            cachedEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4], ci={'method': 'goodman', 'alpha': 0.05})
+            cached_result = cache.fit(cachedEstimator, sorted_data)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            # the fit results of an estimator are not part of its configuration
+            cache.fit(myEstimator, sorted_data)
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+            self.assertEqual(len(myEstimator.matrix_set), 4)
+            self.assertEqual(cachedEstimator.transition_counts, myEstimator.transition_counts)
+            self.assertTrue((cachedEstimator.confint_upper == myEstimator.confint_upper).all())
+            for k in range(4):
+                self.assertTrue((cached_result[k] == result[k]).all())
+            # a different configuration is a different entry (and the least recently used entry is evicted)
+            otherEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+            cache.fit(otherEstimator, sorted_data)
+            self.assertEqual(cache.misses, 2)
+            self.assertEqual(len(cache.entries()), 1)
+            # long array-like configurations (with abbreviated reprs) are keyed by their content
+            bounds = pd.Series(np.arange(1000.0))
+            other_bounds = bounds.copy()
+            other_bounds[500] += 0.5
+            self.assertEqual(repr(bounds), repr(other_bounds))
+            keys = [cache.key(es.CohortEstimator(states=myState, cohort_bounds=b), sorted_data)
+                    for b in (bounds, other_bounds, bounds.copy())]
+            self.assertNotEqual(keys[0], keys[1])
+            self.assertEqual(keys[0], keys[2])
+
+
+class TestBayesianEstimator(unittest.TestCase):
+    """
+    Test the Dirichlet posterior means and the posterior samples
+
+    """
+
+    def test_posterior(self):
+        myState = tm.StateSpace([('0', "A"), ('1', "B"), ('2', "D")])
+        migrations = np.zeros((3, 3, 1))
+        migrations[0, :, 0] = [6, 3, 1]
+        migrations[1, :, 0] = [2, 7, 1]
+        counts = es.TransitionCounts(migrations, migrations.sum(axis=1))
+        prior = np.array([[0.8, 0.15, 0.05], [0.1, 0.8, 0.1], [0.0, 0.0, 1.0]])
+        myEstimator = ba.BayesianEstimator(states=myState, prior=prior, prior_strength=10)
+        myEstimator.fit_counts(counts)
+        self.assertTrue(np.allclose(myEstimator.matrix_set[0][0], [14 / 20, 4.5 / 20, 1.5 / 20]))
+        # unobserved rows have the prior mean
+        self.assertTrue(np.allclose(myEstimator.average_matrix[2], [0, 0, 1]))
+        lower, upper = myEstimator.credible_intervals(alpha=0.05)
+        self.assertTrue((lower <= myEstimator.average_matrix).all() and (myEstimator.average_matrix <= upper).all())
+        samples = myEstimator.sample(20000, seed=1)
+        self.assertEqual(samples.shape, (20000, 3, 3))
+        self.assertTrue(np.allclose(samples.sum(axis=2), 1.0))
+        self.assertTrue(np.allclose(samples.mean(axis=0), myEstimator.average_matrix, atol=0.01))
+
+    def test_fit(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        myState = tm.StateSpace([('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")])
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        myEstimator = ba.BayesianEstimator(states=myState, prior=0.0)
+        myEstimator.fit(sorted_data, cohort_bounds=[0, 1, 2, 3, 4])
+        cohortEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        cohortEstimator.fit(sorted_data)
+        # without prior information the posterior mean is the cohort estimate
+        self.assertTrue(np.allclose(myEstimator.average_matrix, cohortEstimator.average_matrix))
+
+
+class TestRollingCohortEstimator(unittest.TestCase):
+    """
+    Test that the rolling window average matches the average over the most recent cohorts
+
+    """
+
+    def test_rolling_average(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4])
+        myEstimator.fit(sorted_data)
+        counts = myEstimator.transition_counts
+        rollingEstimator = ro.RollingCohortEstimator(window=2, states=myState, ci={'method': 'goodman', 'alpha': 0.05})
+        for k in range(4):
+            average = rollingEstimator.update(counts[k])
+            expected = counts[max(k - 1, 0):k + 1].average()
+            self.assertTrue(np.allclose(average, expected))
+        lower, upper = tm.utils.multinomial_confint(counts[2:4].migrations.sum(axis=2), alpha=0.05)
+        self.assertEqual(rollingEstimator.confint_lower.shape, (3, 3, 1))
+        self.assertTrue(np.allclose(rollingEstimator.confint_lower[:, :, 0], lower))
+        self.assertTrue(np.allclose(rollingEstimator.matrix_set[0], rollingEstimator.get_average()))
+        self.assertEqual(rollingEstimator.cohorts, 4)
+        # the state space dimension is taken from the counts
+        countsEstimator = ro.RollingCohortEstimator(window=2)
+        countsEstimator.update(counts[2:4])
+        self.assertTrue(np.allclose(countsEstimator.get_average(), rollingEstimator.get_average()))
+        refitEstimator = ro.RollingCohortEstimator(window=2, states=myState)
+        refitEstimator.fit(sorted_data, cohort_bounds=[0, 1, 2, 3, 4])
+        self.assertTrue(np.allclose(refitEstimator.get_average(), rollingEstimator.get_average()))
+
+
+class TestTransitionCounts(unittest.TestCase):
+    '''
+    Merge, slice and serialize transition counts
+    '''
+
+    def test_transition_counts(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data5.csv')
+        definition = [('0', "Stage 1"), ('1', "Stage 2"), ('2', "Stage 3")]
+        myState = tm.StateSpace(definition)
+        sorted_data = data.sort_values(['ID', 'Time'], ascending=[True, True])
+        myEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4], ci={'method': 'goodman', 'alpha': 0.05})
+        myEstimator.fit(sorted_data)
+        counts = myEstimator.transition_counts
+        self.assertEqual((counts.states, counts.periods), (3, 4))
+        for k in range(4):
+            self.assertTrue((counts.migrations[:, :, k] == myEstimator.count_set[k]).all())
+        self.assertEqual(counts[1], counts[1:2])
+        self.assertEqual(counts[1:3].periods, 2)
+        self.assertEqual(counts[1:3].population.shape, (3, 3))
+        # merging shards
+        merged = sum([counts, counts])
+        self.assertTrue((merged.migrations == 2 * counts.migrations).all())
+        mergedEstimator = es.CohortEstimator(states=myState, cohort_bounds=[0, 1, 2, 3, 4], ci={'method': 'goodman', 'alpha': 0.05})
+        mergedEstimator.fit_counts(merged)
+        self.assertEqual(mergedEstimator.counts, 2 * myEstimator.counts)
+        for k in range(4):
+            self.assertTrue(np.allclose(mergedEstimator.matrix_set[k], myEstimator.matrix_set[k]))
+        self.assertTrue(np.allclose(mergedEstimator.average_matrix, myEstimator.average_matrix))
+        self.assertFalse(np.isnan(myEstimator.confint_lower[:, :, -1]).any())
+        self.assertTrue((mergedEstimator.confint_upper - mergedEstimator.confint_lower
+                         < myEstimator.confint_upper - myEstimator.confint_lower).all())
+        with self.assertRaises(ValueError):
+            counts + counts[0]
+        # serialization
+        self.assertEqual(es.TransitionCounts(**json.loads(counts.to_json())), counts)
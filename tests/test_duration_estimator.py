@@ -19,6 +19,10 @@ import pandas as pd
 import transitionMatrix as tm
 from transitionMatrix import source_path
 from transitionMatrix.estimators import aalen_johansen_estimator as aj
+from transitionMatrix.estimators import bootstrap as bs
+from transitionMatrix.estimators import kaplan_meier_estimator as km
+from transitionMatrix.estimators import parallel as pl
+from transitionMatrix.estimators import time_homogeneous_estimator as th
 
 ACCURATE_DIGITS = 2
 
@@ -44,3 +48,162 @@ class TestAalenJohansenEstimator(unittest.TestCase):
         self.assertAlmostEqual(result[0, 1, -1], 0.5, places=ACCURATE_DIGITS, msg=None, delta=None)
         self.assertEqual(result[1, 0, -1], 0.0)
         self.assertEqual(result[1, 1, -1], 1.0)
+
+    def test_aalenjohansen_kaplan_meier(self):
+        """ With a single absorbing state the survival probability is the Kaplan-Meier estimate """
+        data = pd.DataFrame({'ID': [0, 1, 2, 3, 0, 1, 2],
+                             'Time': [0.0, 0.0, 0.0, 0.0, 1.0, 2.0, 3.0],
+                             'From': [0, 0, 0, 0, 0, 0, 0],
+                             'To': [0, 0, 0, 0, 1, 1, 1]})
+        myState = tm.StateSpace([('0', "G"), ('1', "D")])
+        myEstimator = aj.AalenJohansenEstimator(states=myState)
+        result, times = myEstimator.fit(data)
+        self.assertEqual(times, [0.0, 1.0, 2.0, 3.0])
+        # the population is the occupation at the start of each period
+        self.assertEqual(myEstimator.transition_counts.population.tolist(), [[4, 4, 3, 2], [0, 0, 1, 2]])
+        self.assertEqual((myEstimator.transition_counts + myEstimator.transition_counts).population.tolist(),
+                         [[8, 8, 6, 4], [0, 0, 2, 4]])
+        for k, survival in enumerate([1.0, 0.75, 0.5, 0.25]):
+            self.assertAlmostEqual(result[0, 0, k], survival, places=ACCURATE_DIGITS)
+        curves = km.KaplanMeierEstimator(states=myState).fit(data, timepoints=times, end_time=3.0)
+        for k in range(len(times)):
+            self.assertAlmostEqual(result[0, 1, k], curves[0, k], places=ACCURATE_DIGITS)
+
+    def test_aalenjohansen_binned_times(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data8.csv')
+        sorted_data = data.sort_values(['Time', 'ID'], ascending=[True, True])
+        definition = [('0', "G"), ('1', "B")]
+        myState = tm.StateSpace(definition)
+        myEstimator = aj.AalenJohansenEstimator(states=myState, binning={'resolution': 0.01})
+        labels = {'Time': 'Time', 'From': 'From', 'To': 'To', 'ID': 'ID'}
+        result, times = myEstimator.fit(sorted_data, labels=labels)
+        self.assertEqual(len(times), myEstimator.timepoint_count)
+        self.assertLess(myEstimator.timepoint_count, data['Time'].nunique())
+        self.assertLess(myEstimator.binning_error, 0.01)
+        self.assertAlmostEqual(result[0, 0, -1], 0.5, places=ACCURATE_DIGITS, msg=None, delta=None)
+        self.assertAlmostEqual(result[0, 1, -1], 0.5, places=ACCURATE_DIGITS, msg=None, delta=None)
+
+    def test_aalenjohansen_bootstrap(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data8.csv')
+        sorted_data = data.sort_values(['Time', 'ID'], ascending=[True, True])
+        definition = [('0', "G"), ('1', "B")]
+        myState = tm.StateSpace(definition)
+        myEstimator = aj.AalenJohansenEstimator(states=myState, binning={'resolution': 0.05})
+        samples = bs.entity_bootstrap(myEstimator, sorted_data, replicates=10, workers=1, seed=1)
+        result, times = myEstimator.fit(sorted_data)
+        self.assertEqual(samples.shape, (10,) + result.shape)
+        lower, upper = bs.bootstrap_confint(samples, alpha=0.05)
+        self.assertTrue((lower[0, 1, :] <= upper[0, 1, :]).all())
+        self.assertAlmostEqual(samples[:, 0, 1, -1].mean(), result[0, 1, -1], places=ACCURATE_DIGITS)
+
+    def test_aalenjohansen_sharded(self):
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data8.csv')
+        sorted_data = data.sort_values(['Time', 'ID'], ascending=[True, True])
+        definition = [('0', "G"), ('1', "B")]
+        myState = tm.StateSpace(definition)
+        myEstimator = aj.AalenJohansenEstimator(states=myState)
+        result, times = myEstimator.fit(sorted_data)
+        shardEstimator = aj.AalenJohansenEstimator(states=myState)
+        sharded_result, sharded_times = pl.sharded_fit(shardEstimator, sorted_data, workers=1, shards=3)
+        self.assertEqual(times, sharded_times)
+        self.assertTrue((result == sharded_result).all())
+        arrayEstimator = aj.AalenJohansenEstimator(states=myState)
+        columns = [sorted_data[c].to_numpy() for c in ['ID', 'Time', 'From', 'To']]
+        array_result, array_times = arrayEstimator.fit_arrays(*columns)
+        self.assertEqual(times, array_times)
+        self.assertTrue((result == array_result).all())
+
+
+class TestTimeHomogeneousEstimator(unittest.TestCase):
+    """
+    Test the generator estimate against hand computed exposures and transition counts
+
+    """
+
+    def test_generator_estimate(self):
+        data = pd.DataFrame({'ID': [0, 0, 0, 1, 2, 2],
+                             'Time': [0.0, 2.0, 3.0, 0.0, 1.0, 2.0],
+                             'State': [0, 1, 2, 0, 1, 0],
+                             'Segment': ['X', 'X', 'X', 'Y', 'Y', 'Y']})
+        definition = [('0', "A"), ('1', "B"), ('2', "D")]
+        myState = tm.StateSpace(definition)
+        myEstimator = th.TimeHomogeneousEstimator(states=myState)
+        generator = myEstimator.fit(data, end_time=4.0)
+        # exposure: state 0: 2 + 4 + 2, state 1: 1 + 1, state 2: 1
+        self.assertEqual(list(myEstimator.exposure), [8.0, 2.0, 1.0])
+        self.assertAlmostEqual(generator[0, 1], 1 / 8, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(generator[1, 0], 1 / 2, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(generator[1, 2], 1 / 2, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(generator[1, 1], -1.0, places=ACCURATE_DIGITS)
+        matrix = myEstimator.transition_matrix(t=2.0)
+        self.assertAlmostEqual(matrix.sum(axis=1)[0, 0], 1.0, places=ACCURATE_DIGITS)
+
+        labels = {'ID': 'ID', 'Time': 'Time', 'State': 'State', 'Segment': 'Segment'}
+        generator = myEstimator.fit(data, labels=labels, end_time=4.0)
+        self.assertEqual(generator.shape, (2, 3, 3))
+        self.assertAlmostEqual(generator[0, 0, 1], 1 / 2, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(generator[1, 1, 0], 1.0, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(myEstimator.transition_matrix(t=1.0, segment='Y')[2, 2], 1.0, places=ACCURATE_DIGITS)
+
+        shardEstimator = th.TimeHomogeneousEstimator(states=myState)
+        sharded_generator = pl.sharded_fit(shardEstimator, data, labels=labels, workers=1, shards=2, end_time=4.0)
+        self.assertTrue(abs(sharded_generator - generator).max() < 1e-12)
+        arrayEstimator = th.TimeHomogeneousEstimator(states=myState)
+        array_generator = arrayEstimator.fit_arrays(data['ID'].to_numpy(), data['Time'].to_numpy(),
+                                                    data['State'].to_numpy(), segment=data['Segment'].to_numpy(),
+                                                    end_time=4.0)
+        self.assertTrue((array_generator == generator).all())
+
+        # repeated observations of unchanged states do not change the estimate
+        snapshots = pd.DataFrame({'ID': [0, 0, 0, 0, 0, 1, 1, 2, 2, 2],
+                                  'Time': [0.0, 1.0, 2.0, 2.5, 3.0, 0.0, 2.0, 1.0, 2.0, 3.0],
+                                  'State': [0, 0, 1, 1, 2, 0, 0, 1, 0, 0]})
+        compressed, ratio = tm.utils.compress_stale_observations(snapshots)
+        self.assertEqual(len(compressed), 8)
+        generator = myEstimator.fit(snapshots, end_time=4.0)
+        self.assertTrue(abs(myEstimator.fit(compressed, end_time=4.0) - generator).max() < 1e-12)
+
+
+class TestKaplanMeierEstimator(unittest.TestCase):
+    """
+    Test the survival curve estimate against a hand computed example with censoring
+
+    """
+
+    def test_kaplan_meier_curves(self):
+        data = pd.DataFrame({'ID': [0, 0, 1, 1, 2, 2, 3, 3, 4],
+                             'Time': [0.0, 1.0, 0.0, 2.0, 0.0, 1.5, 0.0, 3.0, 0.0],
+                             'From': [0, 0, 0, 1, 0, 0, 0, 0, 1],
+                             'To': [0, 2, 0, 2, 0, 1, 0, 1, 1]})
+        definition = [('0', "A"), ('1', "B"), ('2', "D")]
+        myState = tm.StateSpace(definition)
+        myEstimator = km.KaplanMeierEstimator(states=myState)
+        curves = myEstimator.fit(data)
+        self.assertEqual(myEstimator.times, [1.0, 2.0])
+        self.assertAlmostEqual(curves[0, 0], 0.25, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(curves[0, 1], 0.625, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(curves[1, 1], 0.0, places=ACCURATE_DIGITS)
+        curves = myEstimator.fit(data, timepoints=[0.5, 1.5, 5.0])
+        self.assertEqual(curves.shape, (3, 3))
+        self.assertAlmostEqual(curves[0, 0], 0.0, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(curves[0, 1], 0.25, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(curves[0, 2], 0.625, places=ACCURATE_DIGITS)
+        # without absorptions the curves are zero at all timepoints
+        curves = myEstimator.fit(data[data['To'] != 2], timepoints=[0.5, 1.5])
+        self.assertEqual(curves.shape, (3, 2))
+        self.assertAlmostEqual(abs(curves).max(), 0.0, places=ACCURATE_DIGITS)
+        # one row per transition: durations are measured from the start of the observation window
+        transitions = data[data['Time'] > 0]
+        curves = myEstimator.fit(transitions, start_time=0.0)
+        self.assertEqual(myEstimator.times, [1.0, 2.0])
+        self.assertAlmostEqual(curves[0, 0], 1 / 3, places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(curves[1, 1], 1.0, places=ACCURATE_DIGITS)
+        self.assertRaises(ValueError, myEstimator.fit, data, start_time=0.5)
+        # the absorbing state may be given by its label
+        expected = myEstimator.fit(data)
+        labelledEstimator = km.KaplanMeierEstimator(states=tm.StateSpace(definition, absorbing=['D']))
+        self.assertTrue((labelledEstimator.fit(data) == expected).all())
+        self.assertTrue((myEstimator.fit(data, absorbing_state='D') == expected).all())
@@ -15,6 +15,7 @@
 
 import unittest
 
+import numpy as np
 import pandas as pd
 from scipy.linalg import expm
 
@@ -57,6 +58,50 @@ class TestStateSpace(unittest.TestCase):
         definition = [('0', "0"), ('1', "1"), ('2', "2")]
         s = tm.StateSpace(definition)
         self.assertEqual(s.validate_dataset(dataset=data)[0], "Dataset contains the expected states.")
+        snapshots = pd.DataFrame({'ID': [0, 0, 0, 1], 'Time': [0, 1, 2, 0], 'State': [0, 0, 2, 1]})
+        self.assertTrue('1 repeated observations' in s.validate_dataset(dataset=snapshots)[0])
+        s = tm.StateSpace(definition, sticky=True)
+        self.assertEqual(s.validate_dataset(dataset=snapshots)[0], "Dataset contains the expected states.")
+
+    def test_validate_absorbing(self):
+        definition = [('0', "A"), ('1', "B"), ('2', "D"), ('3', "W")]
+        s = tm.StateSpace(definition, absorbing=['D', '3'])
+        data = pd.DataFrame({'ID': [0, 0, 0, 0, 1, 1, 1, 2, 2],
+                             'Time': [0, 1, 2, 3, 0, 1, 2, 0, 1],
+                             'State': ['A', 'D', 'D', 'B', 'B', 'W', None, 'D', 'W']})
+        entity_id, from_state, to_state = s.validate_absorbing(data)
+        self.assertEqual(list(entity_id), [0, 2])
+        self.assertEqual(list(from_state), ['D', 'D'])
+        self.assertEqual(list(to_state), ['B', 'W'])
+        violations, cleaned = s.validate_absorbing(data, truncate=True)
+        self.assertEqual(list(cleaned.index), [0, 1, 2, 4, 5, 6, 7])
+        self.assertEqual(len(s.validate_absorbing(cleaned)[0]), 0)
+
+    def test_encode(self):
+        definition = [('0', "AAA"), ('1', "AA"), ('2', "A"), ('3', "BBB"),
+                       ('4', "BB"), ('5', "B"), ('6', "CCC"), ('7', "D")]
+        s = tm.StateSpace(definition)
+        encoded = s.encode(['AAA', 'B', None, 'D', 3, '4', 2.0])
+        self.assertEqual(list(encoded[[0, 1, 3, 4, 5, 6]]), [0, 5, 7, 3, 4, 2])
+        self.assertTrue(np.isnan(encoded[2]))
+        with self.assertRaises(ValueError) as context:
+            s.encode(['AAA', 'B+', 'WR', 'B+'])
+        self.assertIn('B+', str(context.exception))
+        self.assertIn('WR', str(context.exception))
+        data = pd.DataFrame({'ID': [1, 1, 2], 'Time': [0, 1, 0], 'State': ['AAA', 'AA', 'D']})
+        self.assertEqual(list(s.encode_dataset(data)['State']), [0, 1, 7])
+
+    def test_estimate_with_labels(self):
+        definition = [('0', "AAA"), ('1', "AA"), ('2', "D")]
+        s = tm.StateSpace(definition)
+        data = pd.DataFrame({'ID': [1, 1, 2, 2, 3, 3], 'Time': [0, 1, 0, 1, 0, 1],
+                             'State': ['AAA', 'AA', 'AA', 'D', 'AAA', 'AAA']})
+        labelEstimator = tm.estimators.cohort_estimator.CohortEstimator(states=s, cohort_bounds=[0, 1])
+        labelEstimator.fit(data)
+        indexEstimator = tm.estimators.cohort_estimator.CohortEstimator(states=s, cohort_bounds=[0, 1])
+        indexEstimator.fit(s.encode_dataset(data))
+        self.assertEqual(labelEstimator.transition_counts, indexEstimator.transition_counts)
+        self.assertEqual(labelEstimator.count_set[0][0, 1], 1)
 
 
 if __name__ == "__main__":
@@ -14,7 +14,9 @@
 
 import unittest
 
+import numpy as np
 import pandas as pd
+import statsmodels.stats.proportion as st
 
 import transitionMatrix as tm
 from transitionMatrix import source_path
@@ -34,6 +36,174 @@ class TestPreprocessing(unittest.TestCase):
         cohort_data['Count'] = cohort_data['Count'].astype(int)  # count of events in cohorted format
         self.assertEqual(event_count, cohort_data['Count'].sum())
 
+    def test_bin_timestamps_event_dict(self):
+        """ Check that the cohorted data holds the last event (and the event count) of each cohort interval"""
+
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data1.csv')
+        for remove_stale in [False, True]:
+            cohort_data, cohort_intervals = tm.utils.bin_timestamps(data, cohorts=5, remove_stale=remove_stale)
+            event_dict, cohort_intervals = tm.utils.bin_timestamps(data, cohorts=5, output_format=1,
+                                                                   remove_stale=remove_stale)
+            cohort_data = cohort_data.set_index(['ID', 'Time'])
+            for (entity, cohort), event_list in event_dict.items():
+                if cohort < len(cohort_intervals):
+                    row = cohort_data.loc[(entity, cohort)]
+                    self.assertEqual(row['State'], str(event_list[-1][1])[:1])
+                    self.assertEqual(row['EventTime'], event_list[-1][0])
+                    self.assertEqual(row['Count'], len(event_list) if cohort > 0 else 1)
+
+    def test_event_index(self):
+        """ Check that the event index holds the events of the event dictionary and reduces them per cohort interval"""
+
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data1.csv')
+        dt, cohort_bounds = tm.utils.generate_cohort_bounds(data, 5)
+        event_index = tm.utils.generate_event_index(data, cohort_bounds)
+        event_dict = event_index.to_dict()
+        self.assertEqual(len(event_index), len(event_dict))
+        self.assertEqual(event_index.counts().sum(), sum(len(events) for events in event_dict.values()))
+        last_states = event_index.reduce('last')
+        max_times = event_index.reduce(np.maximum, values='times')
+        for g, event_key in enumerate(event_dict):
+            self.assertEqual(event_index[event_key], event_dict[event_key])
+            self.assertEqual(last_states[g], event_dict[event_key][-1][1])
+            self.assertEqual(max_times[g], max(time for time, state in event_dict[event_key]))
+        self.assertEqual(event_index.remove_stale().to_dict(), tm.utils.remove_stale_events(event_dict))
+
+    def test_event_index_reducers(self):
+        """ Check the state assignment reducers of the event index and of the binned cohorts"""
+
+        data = pd.DataFrame({'ID': [1, 1, 1, 1, 1, 2, 2],
+                             'Time': [0.0, 0.5, 1.0, 1.9, 3.5, 0.0, 4.0],
+                             'State': [0, 2, 1, 2, 1, 1, 0]})
+        event_index = tm.utils.generate_event_index(data, [0.0, 2.0, 4.0])
+        self.assertEqual(list(event_index.reduce('first')), [0, 2, 1, 1, 0])
+        self.assertEqual(list(event_index.reduce('last')), [0, 2, 1, 1, 0])
+        self.assertEqual(list(event_index.reduce('worst')), [0, 2, 1, 1, 0])
+        self.assertEqual(list(event_index.reduce('worst', order=[2, 1, 0])), [0, 1, 1, 1, 0])
+        # state 2 is observed twice, state 1 is held longest (0.9 against 0.5 + 0.1) in the second interval
+        self.assertEqual(list(event_index.reduce('most_frequent')), [0, 2, 1, 1, 0])
+        self.assertEqual(list(event_index.reduce('time_weighted')), [0, 1, 1, 1, 0])
+        self.assertEqual(list(event_index.reduce(lambda values, offsets: np.add.reduceat(values, offsets[:-1]))),
+                         [0, 5, 1, 1, 0])
+
+        dataset_path = source_path + "datasets/"
+        data = pd.read_csv(dataset_path + 'synthetic_data1.csv')
+        last_data, cohort_bounds = tm.utils.bin_timestamps(data, cohorts=5)
+        for reducer in tm.utils.REDUCERS:
+            cohort_data, _ = tm.utils.bin_timestamps(data, cohorts=5, reducer=reducer)
+            self.assertEqual(cohort_data.shape, last_data.shape)
+            pd.testing.assert_series_equal(cohort_data['EventTime'], last_data['EventTime'])
+
+        # multi character state labels are preserved
+        data = pd.DataFrame({'ID': [1, 1, 1, 2, 2, 2],
+                             'Time': [0.0, 1.0, 2.0, 0.0, 1.5, 2.0],
+                             'State': ['AAA', 'A', 'AA', 'BBB', 'AA', 'BBB']})
+        cohort_data, _ = tm.utils.bin_timestamps(data, cohorts=2, reducer='worst', order=['AAA', 'AA', 'A', 'BBB'])
+        self.assertEqual(list(cohort_data['State']), ['AAA', 'A', 'AA', 'BBB', 'BBB', 'BBB'])
+        cohort_data, _ = tm.utils.bin_timestamps(data, cohorts=2, reducer='first')
+        self.assertEqual(list(cohort_data['State']), ['AAA', 'A', 'AA', 'BBB', 'BBB', 'AA'])
+        # the default reducer truncates the labels, unless full labels are requested
+        cohort_data, _ = tm.utils.bin_timestamps(data, cohorts=2)
+        self.assertEqual(list(cohort_data['State']), ['A', 'A', 'A', 'B', 'B', 'B'])
+        cohort_data, _ = tm.utils.bin_timestamps(data, cohorts=2, full_labels=True)
+        self.assertEqual(list(cohort_data['State']), ['AAA', 'A', 'AA', 'BBB', 'BBB', 'BBB'])
+
+    def test_compress_stale_observations(self):
+        """ Check that repeated observations of unchanged states are removed within entities"""
+
+        data = pd.DataFrame({'ID': [0, 0, 0, 0, 1, 1, 2],
+                             'Time': [0.0, 1.0, 2.0, 3.0, 0.0, 1.0, 0.0],
+                             'State': [0, 0, 1, 1, 1, 1, 0]})
+        compressed, ratio = tm.utils.compress_stale_observations(data)
+        self.assertEqual(list(compressed.index), [0, 2, 3, 4, 5, 6])
+        self.assertAlmostEqual(ratio, 7 / 6, places=ACCURATE_DIGITS)
+        compressed, ratio = tm.utils.compress_stale_observations(data, keep='last')
+        self.assertEqual(list(compressed.index), [1, 3, 5, 6])
+        self.assertAlmostEqual(ratio, 7 / 4, places=ACCURATE_DIGITS)
+        event_dict = {(0, 1): [(0.5, 'A'), (0.6, 'A'), (0.7, 'B')], (1, 1): [(0.5, 'A')]}
+        self.assertEqual(tm.utils.remove_stale_events(event_dict), {(0, 1): [(0.6, 'A'), (0.7, 'B')],
+                                                                    (1, 1): [(0.5, 'A')]})
+
+    def test_dataset_profile(self):
+        """ Check the single pass dataset profile against a hand computed example and its caching"""
+
+        data = pd.DataFrame({'ID': [0, 0, 0, 1, 1, 2],
+                             'Time': [0.0, 1.0, 3.0, 0.0, 2.0, 1.0],
+                             'State': [0, 1, 1, 2, None, 0]})
+        profile = tm.utils.dataset_profile(data)
+        self.assertEqual(profile['unique_entities'], 3)
+        self.assertEqual(profile['events_per_entity']['max'], 3)
+        self.assertEqual(profile['unique_states'], 4)
+        self.assertEqual(profile['missing_states'], 1)
+        self.assertEqual(profile['state_counts'][1], 2)
+        self.assertEqual(profile['unique_timestamps'], 4)
+        self.assertEqual(list(profile['period_counts']), [2, 2, 1, 1])
+        self.assertEqual(profile['time_range'], (0.0, 3.0))
+        self.assertEqual(profile['event_gaps']['max'], 2.0)
+        self.assertTrue(profile['sorted'])
+        self.assertFalse(profile['sorted_by_time'])
+        self.assertIs(tm.utils.dataset_profile(data.copy()), profile)
+        self.assertFalse(tm.utils.dataset_profile(data.iloc[::-1])['sorted'])
+        self.assertEqual(tm.utils.transitions_summary(data), {'unique_entities': 3, 'unique_states': 4,
+                                                              'unique_timestamps': 4, 'total_timestamps': 6})
+
+    def test_bin_event_times(self):
+        """ Check that binning merges close timestamps and reports the introduced time shift"""
+
+        times = [0.0, 0.1, 0.12, 0.5, 0.51, 0.52, 1.0]
+        binned, error = tm.utils.bin_event_times(times, resolution=0.25)
+        self.assertEqual(list(binned), [0.0, 0.0, 0.0, 0.5, 0.5, 0.5, 1.0])
+        self.assertAlmostEqual(error, 0.12, places=ACCURATE_DIGITS)
+        binned, error = tm.utils.bin_event_times(times, tolerance=0.015)
+        self.assertEqual(len(set(binned)), 5)
+        self.assertAlmostEqual(error, 0.02, places=ACCURATE_DIGITS)
+
+
+class TestExposure(unittest.TestCase):
+
+    def test_state_exposure(self):
+        """ Check time at risk per state and interval against a hand computed example"""
+
+        entity_id = [0, 0, 1, 1, 1]
+        event_time = [0.0, 1.5, 0.5, 2.5, 3.0]
+        entity_state = [0, 1, 1, 0, 1]
+        exposure = tm.utils.state_exposure(entity_id, event_time, entity_state, [0.0, 1.0, 2.0, 4.0], 2,
+                                           end_time=4.0)
+        # entity 0: state 0 in [0, 1.5), state 1 in [1.5, 4)
+        # entity 1: state 1 in [0.5, 2.5), state 0 in [2.5, 3), state 1 in [3, 4)
+        expected = [[1.0, 0.5, 0.5], [0.5, 1.5, 3.5]]
+        for s in range(2):
+            for k in range(3):
+                self.assertAlmostEqual(exposure[s, k], expected[s][k], places=ACCURATE_DIGITS)
+        chunked = tm.utils.state_exposure(entity_id, event_time, entity_state, [0.0, 1.0, 2.0, 4.0], 2,
+                                          end_time=4.0, chunk_size=1)
+        self.assertAlmostEqual(abs(chunked - exposure).max(), 0.0, places=ACCURATE_DIGITS)
+
+
+class TestConfidence(unittest.TestCase):
+
+    def test_multinomial_confint(self):
+        """ Check the vectorized confidence intervals against statsmodels for every (From State, Period) row"""
+
+        counts = np.array([[[10, 0], [5, 3], [1, 0]], [[2, 7], [2, 7], [0, 1]], [[0, 0], [0, 0], [0, 0]]])
+        lower, upper = tm.utils.multinomial_confint(counts, alpha=0.05, method='goodman')
+        self.assertEqual(lower.shape, counts.shape)
+        for s in range(2):
+            for k in range(2):
+                intervals = st.multinomial_proportions_confint(counts[s, :, k], alpha=0.05, method='goodman')
+                for s2 in range(3):
+                    self.assertAlmostEqual(lower[s, s2, k], intervals[s2, 0], places=ACCURATE_DIGITS)
+                    self.assertAlmostEqual(upper[s, s2, k], intervals[s2, 1], places=ACCURATE_DIGITS)
+        self.assertTrue(np.isnan(lower[2]).all())
+        lower, upper = tm.utils.multinomial_confint(counts, alpha=0.05, method='wilson')
+        wilson = st.proportion_confint(5, 16, alpha=0.05, method='wilson')
+        self.assertAlmostEqual(lower[0, 1, 0], wilson[0], places=ACCURATE_DIGITS)
+        self.assertAlmostEqual(upper[0, 1, 0], wilson[1], places=ACCURATE_DIGITS)
+        lower, upper = tm.utils.multinomial_confint(counts, alpha=0.05, method='binomial')
+        self.assertTrue((lower[:2] >= 0).all() and (upper[:2] <= 1).all())
+
 
 class TestDataSetGenerators(unittest.TestCase):
     pass
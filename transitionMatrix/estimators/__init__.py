@@ -14,6 +14,51 @@
 
 from __future__ import print_function
 
+import functools
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+from transitionMatrix.estimators.transition_counts import TransitionCounts
+from transitionMatrix.utils.preprocessing import bin_event_times
+
+__all__ = ['instrumented', 'BaseEstimator', 'DurationEstimator', 'TransitionCounts']
+
+
+def instrumented(method):
+    """
+    Decorator of estimation entry points (fit, fit_arrays, fit_counts etc.). If the estimator instrumentation is
+    enabled (see BaseEstimator.instrument), the phases recorded during the call are collected into the fit_stats
+    record of the estimator and passed to the callback. Nested entry points are part of the outermost record.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._instrumentation is None or self._stats is not None:
+            return method(self, *args, **kwargs)
+        memory = self._instrumentation['memory']
+        started_tracing = memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        self._stats = {'estimator': type(self).__name__, 'method': method.__name__, 'phases': []}
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            stats, self._stats = self._stats, None
+            stats['seconds'] = time.perf_counter() - start
+            if memory:
+                stats['peak_memory'] = max([phase['peak_memory'] for phase in stats['phases']], default=0)
+            if started_tracing:
+                tracemalloc.stop()
+        self.fit_stats = stats
+        if self._instrumentation['callback'] is not None:
+            self._instrumentation['callback'](stats)
+        return result
+
+    return wrapper
+
 
 class BaseEstimator(object):
 
@@ -35,10 +80,88 @@ class BaseEstimator(object):
         self.confint_upper = None
         self.counts = None
         self.nans = None
+        self.transition_counts = None
+        self.fit_stats = None
+        self._instrumentation = None
+        self._stats = None
+
+    def __getstate__(self):
+        # the instrumentation (with a possibly unpicklable callback) is not transferred to worker processes or caches
+        state = self.__dict__.copy()
+        state.pop('_instrumentation', None)
+        state.pop('_stats', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._instrumentation = None
+        self._stats = None
 
     def get_matrix_set(self):
         return self.matrix_set
 
+    def instrument(self, memory=False, callback=None):
+        """
+        Enable the (opt-in) instrumentation of estimations. Each estimation stores a fit_stats record with the wall
+        time of the estimation phases (e.g. ingestion, counting, normalization, confidence), the number of rows
+        processed and optionally the peak allocated memory of each phase:
+
+        .. code-block:: python
+
+            {'estimator': 'CohortEstimator', 'method': 'fit', 'seconds': 0.012, 'peak_memory': 2097152,
+             'phases': [{'name': 'ingestion', 'seconds': 0.004, 'rows': 4000, 'peak_memory': 2097152}, ...]}
+
+        :param memory: measure the peak memory allocated in each phase (in bytes) with tracemalloc (slows down the estimation)
+        :param callback: an optional function called with each fit_stats record (e.g. logging.getLogger(__name__).info)
+        :returns: the estimator
+        """
+        self._instrumentation = {'memory': memory, 'callback': callback}
+        return self
+
+    @contextmanager
+    def _phase(self, name, rows=None):
+        """ Record the wall time (and peak memory) of an estimation phase if instrumentation is enabled """
+        if self._stats is None:
+            yield
+            return
+        memory = self._instrumentation['memory']
+        if memory:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase = {'name': name, 'seconds': time.perf_counter() - start, 'rows': rows}
+            if memory:
+                phase['peak_memory'] = tracemalloc.get_traced_memory()[1] - baseline
+            self._stats['phases'].append(phase)
+
+    def entity_contributions(self, data, labels=None):
+        """
+        Decompose the estimator counts into per-entity contributions. Each contribution is a unit increment of
+        one cell of the flattened count vector of the estimator, hence the counts of any reweighting of entities
+        are a weighted bincount (as used by the entity resampling bootstrap).
+
+        Implemented by estimators that provide _event_arrays, _count_cells and estimate_from_counts
+
+        :param data: the dataframe with the estimation data
+        :param labels: an optional dictionary for relabeling column names
+        :returns: owner (entity index of each contribution), cells (count cell of each contribution), entity_count, cell_count
+        """
+        event_arrays = self._event_arrays(data, labels)
+        event_index, cells = self._count_cells(*event_arrays)
+        entities, entity_index = np.unique(event_arrays[0], return_inverse=True)
+        owner = entity_index.reshape(-1)[event_index]
+        return owner, cells, len(entities), self._cell_count()
+
+    def _prepare_shards(self, event_arrays):
+        """
+        Set up any state that is common to all shards of the data (see transitionMatrix.estimators.parallel).
+        Sharded estimation is implemented by estimators that provide _event_arrays, _shard_counts and _fit_shards
+        """
+        pass
+
     def print(self, select='Frequencies', period=None):
         """
         Pretty print the estimated transition matrices
@@ -110,7 +233,7 @@ class DurationEstimator(BaseEstimator):
     Offers methods common to all duration based estimators
     Two subclasses:
 
-    * Time homogeneous estimator (constant transition rates)
+    * Time homogeneous estimator (constant transition rates) TimeHomogeneousEstimator
     * Time inhomogeneous estimator (variable transition probabilities) Aalen-Johansen
 
     T(s, t) = T(0, t)  (transition from start=0)
@@ -119,11 +242,32 @@ class DurationEstimator(BaseEstimator):
     Transitions at cohort intervals
     Approximate numpy(i,j, k_index : largest k-value that is less than t(boundary))
 
+    Optional binning of close observation times (see :func:`transitionMatrix.utils.preprocessing.bin_event_times`)
+    is configured with a dictionary, e.g. {'resolution': 1 / 365} or {'tolerance': 0.001}
+
     """
 
-    def __init__(self, cohort_intervals=None, states=None):
+    def __init__(self, cohort_intervals=None, states=None, binning=None):
         BaseEstimator.__init__(self)
         self.cohort_intervals = cohort_intervals
         if states is not None:
             self.states = states
+        if binning is not None:
+            assert (set(binning.keys()) <= {'resolution', 'tolerance', 'origin'})
+        self.binning = binning
+        self.binning_error = None
         self.timepoint_count = None
+
+    def bin_times(self, event_times):
+        """
+        Apply the configured binning to an array of observation times and record the approximation error
+
+        :param event_times: array-like of observation times
+        :return: the binned observation times
+        """
+        event_times = np.asarray(event_times, dtype=float)
+        if self.binning is None:
+            self.binning_error = 0.0
+            return event_times
+        binned_times, self.binning_error = bin_event_times(event_times, **self.binning)
+        return binned_times
@@ -16,8 +16,8 @@ from __future__ import print_function
 
 import numpy as np
 
-import transitionMatrix as tm
-from transitionMatrix.estimators import DurationEstimator
+from transitionMatrix.estimators import DurationEstimator, instrumented
+from transitionMatrix.estimators.transition_counts import TransitionCounts
 
 
 class AalenJohansenEstimator(DurationEstimator):
@@ -29,8 +29,8 @@ class AalenJohansenEstimator(DurationEstimator):
 
     """
 
-    def __init__(self, states=None):
-        DurationEstimator.__init__(self)
+    def __init__(self, states=None, binning=None):
+        DurationEstimator.__init__(self, binning=binning)
         # if not (0 < alpha <= 1.):
         #     raise ValueError('alpha parameter must be between 0 and 1.')
         if states is not None:
@@ -38,6 +38,7 @@ class AalenJohansenEstimator(DurationEstimator):
         self.etm = None
         self.times = None
 
+    @instrumented
     def fit(self, data, labels=None):
         """
         Parameters
@@ -64,7 +65,9 @@ class AalenJohansenEstimator(DurationEstimator):
 
 
         * TODO Store counts as well as frequencies
-        * TODO Optional Binning of close observation times
+
+        Close observation times are merged if the estimator was constructed with a binning configuration. The
+        maximum time shift introduced is available as binning_error
 
 
         .. note::
@@ -75,6 +78,56 @@ class AalenJohansenEstimator(DurationEstimator):
 
         """
 
+        # Store event data in 1d arrays for faster processing
+        with self._phase('ingestion', rows=len(data)):
+            event_arrays = self._event_arrays(data, labels)
+        return self._fit_events(event_arrays)
+
+    @instrumented
+    def fit_arrays(self, event_id, event_time, event_from_state, event_to_state):
+        """
+        Estimate the empirical transition matrix from event arrays instead of a dataframe (e.g. columns held by a
+        feature store). Any array-like or buffer protocol object (memoryview, array.array) is accepted; contiguous
+        numpy arrays (float times, integer states) are used without copies. The result is identical to fit.
+
+        :param event_id: array of entity identifiers
+        :param event_time: array of transition times (in ascending order)
+        :param event_from_state: array of states from where a transition occurs (state indexes or labels)
+        :param event_to_state: array of states to which a transition occurs
+
+        :returns: etm, times
+        """
+        with self._phase('ingestion', rows=len(event_id)):
+            event_arrays = self._encode_events(event_id, event_time, event_from_state, event_to_state)
+        return self._fit_events(event_arrays)
+
+    def _fit_events(self, event_arrays):
+        event_id, event_time, event_from_state, event_to_state, event_exists = event_arrays
+
+        self.nans = int((~event_exists).sum())
+        self.counts = len(event_id)
+
+        Debug = False
+        if Debug:
+            print('Events ', self.counts)
+            print('NaNs ', self.nans)
+
+        # Count initial states and migrations, then compute the product integral
+        with self._phase('counting', rows=len(event_id)):
+            event_index, cells = self._count_cells(event_id, event_time, event_from_state, event_to_state,
+                                                   event_exists)
+            counts = np.bincount(cells, minlength=self._cell_count())
+
+        # The empirical transition matrix
+        return self.fit_counts(self._transition_counts(counts))
+
+    def _event_arrays(self, data, labels=None):
+        """
+        Extract the event data of a canonical format dataframe into 1d arrays. Observation times are binned
+        if a binning configuration is set. Rows with missing states are flagged as not existing. States are encoded
+        with the state space (state indexes or labels).
+
+        """
         if labels is not None:
             from_label = labels['From']
             to_label = labels['To']
@@ -82,141 +135,164 @@ class AalenJohansenEstimator(DurationEstimator):
             id_label = labels['ID']
         else:
             from_label = 'From'
-            to_lable = 'To'
+            to_label = 'To'
             id_label = 'ID'
             timestep_label = 'Time'
 
-        # The dimension of the transition matrix
+        return self._encode_events(data[id_label].to_numpy(), data[timestep_label].to_numpy(),
+                                   data[from_label].to_numpy(), data[to_label].to_numpy())
+
+    def _encode_events(self, event_id, event_time, event_from_state, event_to_state):
+        """
+        Convert event arrays into the estimator representation: binned float times, encoded states and the
+        existence flag of each event. Numeric inputs are not copied (unless binned).
+
+        """
+        event_id = np.asarray(event_id)
+        event_time = self.bin_times(event_time)
+        event_from_state = self.states.encode(np.asarray(event_from_state))
+        event_to_state = self.states.encode(np.asarray(event_to_state))
+        event_exists = ~(np.isnan(event_from_state) | np.isnan(event_to_state))
+
+        return event_id, event_time, event_from_state, event_to_state, event_exists
+
+    def _cell_count(self):
+        """ Size of the flattened count vector: initial state counts followed by the (From, To, Timepoint) migrations """
         state_dim = self.states.cardinality
+        return state_dim + state_dim * state_dim * self.timepoint_count
 
-        # extract observation times
-        observation_times = tm.utils.unique_timestamps(data)
+    def _count_cells(self, event_id, event_time, event_from_state, event_to_state, event_exists,
+                     observation_times=None):
+        """
+        Map events to the cells of the flattened count vector.
 
-        # Store event data in 1d arrays for faster processing
-        event_count = data[id_label].count()
-        event_id = np.empty(event_count, int)
-        event_from_state = np.empty(event_count, int)
-        event_to_state = np.empty(event_count, int)
-        event_time = np.empty(event_count, float)
-        event_timepoint = np.empty(event_count, int)
-        event_exists = np.empty(event_count, bool)
-        event_exists.fill(False)
-
-        # Capture nan events for potentially missing observations
-        nan_count = 0
-        i = 0  # count of events
-        t = 0  # count of distinct timepoints
-
-        # TODO remove row hardwiring
-
-        for row in data.itertuples():
-            try:
-                event_id[i] = row[1]
-                event_time[i] = row[2]
-                event_from_state[i] = int(row[3])
-                event_to_state[i] = int(row[4])
-                # Identify migrations
-                if event_to_state[i] != event_from_state[i]:
-                    event_exists[i] = True # indicates valid (complete) data row
-                # Identify timepoint index
-                if i == 0:
-                    event_timepoint[i] = 0
-                elif i > 0 and event_time[i] > event_time[i - 1]:
-                    t += 1  # we have moved to next distinct event time
-                    event_timepoint[i] = t
-                elif i > 0 and event_time[i] == event_time[i - 1]:
-                    event_timepoint[i] = t  # we are still in the same event time
-
-            except ValueError:
-                nan_count += 1
-            i += 1
-
-        self.nans = nan_count
-        self.counts = event_count
-        self.timepoint_count = t
+        * the first observation of each entity contributes to the initial state count Y^m_0
+        * each observed migration contributes to dN^{mn}_{k} from m to n at timepoint k > 0
 
-        Debug = False
-        if Debug:
-            print('Events ', self.counts)
-            print('NaNs ', self.nans)
+        The distinct observation times are stored in the times attribute, unless they are given (e.g. the times of
+        the complete dataset when counting a shard of it)
 
-        # Find the initial states of all entities
-        unique_ids = list(data[id_label].unique())
-        y_initial_count = np.zeros((state_dim,), dtype=int)
-        for i in range(0, event_count - 1):
-            if event_id[i] in unique_ids:
-                item = unique_ids.index(event_id[i])
-                y_initial_count[int(event_from_state[i])] += 1
-                unique_ids.pop(item)
+        :returns: the index of the contributing event and the count cell
 
-        # Initialize empirical transition matrix
-        etm = np.zeros((state_dim, state_dim, self.timepoint_count), dtype=float)
-        etm[:, :, 0] = np.eye(state_dim, state_dim)
+        """
+        state_dim = self.states.cardinality
 
-        # Initialize Migration counts
-        dN = np.zeros((state_dim, state_dim, self.timepoint_count), dtype=int)
+        # Identify the timepoint index of each event
+        if observation_times is None:
+            observation_times, event_timepoint = np.unique(event_time, return_inverse=True)
+            event_timepoint = event_timepoint.reshape(-1)
+            self.timepoint_count = len(observation_times)
+            self.times = list(observation_times)
+        else:
+            event_timepoint = np.searchsorted(observation_times, event_time)
 
-        # Initialize State Occupation counts
-        y = np.zeros((state_dim, self.timepoint_count), dtype=int)
-        y[:, 0] = y_initial_count
+        valid = np.flatnonzero(event_exists)
+        from_state = event_from_state[valid].astype(int)
+        to_state = event_to_state[valid].astype(int)
+        timepoint = event_timepoint[valid]
 
-        # Initialize transition densities
-        dA = np.zeros((state_dim, state_dim, self.timepoint_count), dtype=float)
+        # Find the initial states of all entities
+        _, first = np.unique(event_id[valid], return_index=True)
+        initial_cells = from_state[first]
+
+        # Identify migrations
+        migration = (to_state != from_state) & (timepoint > 0)
+        migration_cells = state_dim + (from_state[migration] * state_dim + to_state[migration]) \
+            * self.timepoint_count + timepoint[migration]
+
+        event_index = np.concatenate((valid[first], valid[migration]))
+        cells = np.concatenate((initial_cells, migration_cells))
+        return event_index, cells
+
+    def _prepare_shards(self, event_arrays):
+        """ The timepoints are common to all shards: they are the distinct observation times of the complete data """
+        observation_times = np.unique(event_arrays[1])
+        self.timepoint_count = len(observation_times)
+        self.times = list(observation_times)
+
+    def _shard_counts(self, event_arrays):
+        event_index, cells = self._count_cells(*event_arrays, observation_times=np.asarray(self.times))
+        return np.bincount(cells, minlength=self._cell_count())
+
+    def _fit_shards(self, counts, event_arrays):
+        self.nans = int((~event_arrays[4]).sum())
+        self.counts = len(event_arrays[0])
+        return self.fit_counts(self._transition_counts(counts))
+
+    def _transition_counts(self, counts):
+        """
+        Convert a flattened count vector (see _count_cells) into TransitionCounts holding the migrations dN^{mn}_k
+        and the population (risk set) Y^m_k at each timepoint. As for the cohort estimator, the population is the
+        number of entities in state m at the start of period k (before the migrations at timepoint k)
+        """
+        state_dim = self.states.cardinality
+        timepoint_count = self.timepoint_count
+        y_initial_count = np.asarray(counts[:state_dim])
+        dN = np.asarray(counts[state_dim:]).reshape((state_dim, state_dim, timepoint_count))
 
         #
-        # Loop over data (id, time, from_state, to_state)
-        #
-        # 1. calculate migrations count dN^{mn}_{k} from m to n at timepoint k
+        # 2. calculate population count Y^m_k per state m at timepoint k: the risk set just before the jumps at t_k
         #
-        for i in range(0, event_count - 1):
-            # if we have a valid data point
-            if event_exists[i]:
-                # if we have an observed transition
-                if event_timepoint[i] > 0:
-                    dN[event_from_state[i], event_to_state[i], event_timepoint[i]] += 1
+        y = np.empty((state_dim, timepoint_count), dtype=np.result_type(y_initial_count, dN))
+        if timepoint_count > 0:
+            y[:, 0] = y_initial_count
+            y[:, 1:] = y_initial_count[:, np.newaxis] \
+                + np.cumsum(dN.sum(axis=0) - dN.sum(axis=1), axis=1)[:, :-1]
+        return TransitionCounts(dN, y)
+
+    def estimate_from_counts(self, counts):
+        """
+        Compute the empirical transition matrix from a flattened count vector (see _count_cells). Counts may be
+        weighted (non-integer), as is the case for bootstrap replicates.
 
-        #
-        # 2. calculate population count Y^m_k per state m at timepoint k
-        #
-        for k in range(1, self.timepoint_count - 1):
-            for m in range(0, state_dim):
-                migration_to_m = 0
-                migration_from_m = 0
-                for n in range(0, state_dim):
-                    if n != m:
-                        migration_to_m += dN[n, m, k]
-                        migration_from_m += dN[m, n, k]
-                y[m, k] = y[m, k - 1] + migration_to_m - migration_from_m
-                dN[m, m, k] = migration_from_m
+        :returns: etm: three dimensional array object (From State, To State, Timepoint)
+
+        """
+        return self._product_integral(self._transition_counts(counts))
+
+    @instrumented
+    def fit_counts(self, transition_counts, times=None):
+        """
+        Estimate the empirical transition matrix from (possibly merged) transition counts. Counts of different
+        shards can only be merged if they are defined on the same timepoints.
+
+        :param transition_counts: TransitionCounts with (S, S, T) migrations and (S, T) population counts
+        :param times: the observation times of the T timepoints
+
+        :returns: etm, times
+        """
+        self.transition_counts = transition_counts
+        if times is not None:
+            self.times = list(times)
+        with self._phase('product_integral', rows=transition_counts.periods):
+            self.etm = self._product_integral(transition_counts)
+        return self.etm, self.times
+
+    @staticmethod
+    def _product_integral(transition_counts):
+        state_dim = transition_counts.states
+        timepoint_count = transition_counts.periods
+        dN = np.array(transition_counts.migrations, dtype=float)
+        y = np.asarray(transition_counts.population, dtype=float)
+        diagonal = np.arange(state_dim)
+        dN[diagonal, diagonal, :] = 0
+        dN[diagonal, diagonal, :] = dN.sum(axis=1)
 
         #
         # 3. calculate off-diagonal element dA^{mn}_{k} from m to n at timepoint k
         # 4. calculate diagonal element dA^{n}_{k} at timepoint k
         #
-        for k in range(1, self.timepoint_count - 1):
-            for m in range(0, state_dim):
-                for n in range(0, state_dim):
-                    if y[m, k] != 0:
-                        if m != n:
-                            dA[m, n, k] = dN[m, n, k] / y[m, k]
-                        else:
-                            dA[m, m, k] = - dN[m, m, k] / y[m, k]
-                    else:
-                        dA[m, n, k] = 0
+        dA = np.zeros((state_dim, state_dim, timepoint_count), dtype=float)
+        np.divide(dN, y[:, np.newaxis, :], out=dA, where=(y != 0)[:, np.newaxis, :])
+        dA[diagonal, diagonal, :] *= -1
 
         #
         # 5. calculate transition matrix T^{mn}_{k} at timepoint k
         #
         identity = np.eye(state_dim, dtype=float)
-        for k in range(1, self.timepoint_count):
-            # for k in range(1, 4):
-            for m in range(0, state_dim):
-                for n in range(0, state_dim):
-                    for q in range(0, state_dim):
-                        etm[m, n, k] += etm[m, q, k - 1] * (identity[q, n] + dA[q, n, k])
+        etm = np.zeros((state_dim, state_dim, timepoint_count), dtype=float)
+        etm[:, :, 0] = identity
+        for k in range(1, timepoint_count):
+            etm[:, :, k] = etm[:, :, k - 1] @ (identity + dA[:, :, k])
 
-        # The empirical transition matrix
-        self.etm = etm
-        self.times = observation_times
-
-        return self.etm, self.times
+        return etm
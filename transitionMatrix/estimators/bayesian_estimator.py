@@ -0,0 +1,144 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import numpy as np
+from scipy import stats
+
+from transitionMatrix.estimators import BaseEstimator
+from transitionMatrix.estimators.cohort_estimator import CohortEstimator
+from transitionMatrix.estimators.simple_estimator import SimpleEstimator
+
+
+class BayesianEstimator(BaseEstimator):
+    """
+    Class for implementing a Bayesian (Dirichlet-multinomial) estimator of transition matrices
+
+    Each row of a transition matrix has a Dirichlet prior with concentration parameters alpha_i. Given migration
+    counts N_ij the posterior is again Dirichlet with parameters alpha_ij + N_ij, hence
+
+    * the posterior mean is (alpha_ij + N_ij) / sum_j (alpha_ij + N_ij)
+    * rows without observations (e.g. low default portfolios) fall back to the prior mean instead of a degenerate row
+
+    The prior is either a (symmetric) concentration value, an (S, S) array of pseudo-counts, or a prior transition
+    matrix (e.g. transitionMatrix.creditratings.predefined.JLT) weighted with prior_strength pseudo-observations
+    per state.
+
+    """
+
+    def __init__(self, states=None, prior=1.0, prior_strength=None):
+        """
+        :param states: the state space
+        :param prior: symmetric concentration (scalar), (S, S) pseudo-counts, or an (S, S) prior transition matrix if prior_strength is given
+        :param prior_strength: the number of pseudo-observations per state (scalar or per state) of a prior transition matrix
+        """
+        BaseEstimator.__init__(self)
+        if states is not None:
+            self.states = states
+        state_dim = self.states.cardinality
+        prior = np.asarray(prior, dtype=float)
+        if prior.ndim == 0:
+            prior = np.full((state_dim, state_dim), float(prior))
+        elif prior.shape != (state_dim, state_dim):
+            raise ValueError('The prior must be a scalar or an array of shape (S, S)')
+        if prior_strength is not None:
+            prior = prior * np.reshape(np.asarray(prior_strength, dtype=float), (-1, 1))
+        if (prior < 0).any():
+            raise ValueError('Dirichlet concentration parameters must be non-negative')
+        self.prior = prior
+        self.posterior = None
+
+    def fit(self, data, labels=None, cohort_bounds=None):
+        """
+        Count transitions (with the cohort estimator if cohort bounds are given, else with the simple estimator)
+        and compute the posterior
+
+        :param data: dataframe with the estimation data (in the format of the respective count estimator)
+        :param labels: an optional dictionary for relabeling column names
+        :param cohort_bounds: the cohort bounds (for cohort data in compact format)
+
+        :returns: matrix_set : the posterior mean transition matrices
+        """
+        if cohort_bounds is not None:
+            estimator = CohortEstimator(cohort_bounds=cohort_bounds, states=self.states)
+        else:
+            estimator = SimpleEstimator(states=self.states)
+        estimator.fit(data, labels=labels)
+        self.nans = estimator.nans
+        return self.fit_counts(estimator.transition_counts)
+
+    def fit_counts(self, transition_counts):
+        """
+        Compute the posterior of each period (and of all periods pooled) from transition counts
+
+        :param transition_counts: TransitionCounts with (S, S, K) migration counts
+
+        :returns: matrix_set : the posterior mean transition matrices
+        """
+        self.transition_counts = transition_counts
+        self.counts = transition_counts.population[:, :transition_counts.periods].sum()
+        # posterior concentration parameters (From State, To State, Period)
+        self.posterior = self.prior[:, :, np.newaxis] + transition_counts.migrations
+        means = self._mean(self.posterior, axis=1)
+        self.matrix_set = [means[:, :, k] for k in range(transition_counts.periods)]
+        self.average_matrix = self._mean(self.prior + transition_counts.migrations.sum(axis=2), axis=1)
+        return self.matrix_set
+
+    @staticmethod
+    def _mean(alpha, axis):
+        total = alpha.sum(axis=axis, keepdims=True)
+        mean = np.zeros(alpha.shape, dtype=float)
+        np.divide(alpha, total, out=mean, where=total > 0)
+        return mean
+
+    def _concentration(self, period=None):
+        if period is None:
+            return self.prior + self.transition_counts.migrations.sum(axis=2)
+        return self.posterior[:, :, period]
+
+    def credible_intervals(self, alpha=0.05, period=None):
+        """
+        Equal tailed credible intervals of the transition probabilities (from the Beta marginals of the posterior)
+
+        :param alpha: significance level
+        :param period: the period (default is all periods pooled)
+        :returns: lower, upper arrays of shape (S, S)
+        """
+        concentration = self._concentration(period)
+        rest = concentration.sum(axis=1, keepdims=True) - concentration
+        with np.errstate(invalid='ignore'):
+            lower = stats.beta.ppf(alpha / 2, concentration, rest)
+            upper = stats.beta.ppf(1 - alpha / 2, concentration, rest)
+        # degenerate marginals (zero concentration) are point masses
+        lower = np.where(concentration == 0, 0.0, np.where(rest == 0, 1.0, lower))
+        upper = np.where(concentration == 0, 0.0, np.where(rest == 0, 1.0, upper))
+        return lower, upper
+
+    def sample(self, size, period=None, seed=None):
+        """
+        Draw transition matrices from the posterior. Rows are drawn as normalized independent gamma variates, all
+        samples are generated in one batch.
+
+        :param size: the number of samples
+        :param period: the period (default is all periods pooled)
+        :param seed: seed (or numpy Generator) for reproducible samples
+        :type size: int
+
+        :returns: array of shape (size, S, S)
+        """
+        rng = np.random.default_rng(seed)
+        concentration = self._concentration(period)
+        draws = rng.standard_gamma(np.broadcast_to(concentration, (size,) + concentration.shape))
+        return self._mean(draws, axis=2)
@@ -0,0 +1,136 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Entity resampling bootstrap for transition matrix estimators
+
+Entities (not individual rows) are resampled with replacement so that the dependence between successive
+observations of the same entity is preserved. The count contributions of each entity are computed once
+(see BaseEstimator.entity_contributions), hence each replicate is a weighted sum of contributions followed by the
+estimator specific normalization, rather than a refit of the estimator.
+
+Supported estimators: CohortEstimator, AalenJohansenEstimator
+
+"""
+
+from __future__ import print_function
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Replicate inputs are shipped once per worker process (at pool initialization)
+_replicate_inputs = {}
+
+
+def _initialize_replicates(estimator, owner, cells, entity_count, cell_count, statistic):
+    _replicate_inputs.update(estimator=estimator, owner=owner, cells=cells, entity_count=entity_count,
+                             cell_count=cell_count, statistic=statistic)
+
+
+def _replicate_batch(seed, size):
+    """ Compute a batch of bootstrap replicates using an independent random stream """
+    estimator = _replicate_inputs['estimator']
+    owner = _replicate_inputs['owner']
+    cells = _replicate_inputs['cells']
+    entity_count = _replicate_inputs['entity_count']
+    cell_count = _replicate_inputs['cell_count']
+    statistic = _replicate_inputs['statistic']
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for r in range(size):
+        # number of times each entity is drawn in this replicate
+        weights = np.bincount(rng.integers(entity_count, size=entity_count), minlength=entity_count)
+        counts = np.bincount(cells, weights=weights[owner], minlength=cell_count)
+        result = estimator.estimate_from_counts(counts)
+        if statistic is not None:
+            result = statistic(result)
+        results.append(result)
+    return np.stack(results)
+
+
+def entity_bootstrap(estimator, data, labels=None, replicates=1000, statistic=None, workers=None, seed=None,
+                     batch_size=50):
+    """
+    Generate bootstrap replicates of an estimator result by resampling entities
+
+    :param estimator: a configured estimator (CohortEstimator or AalenJohansenEstimator)
+    :param data: the dataframe with the estimation data (in the format expected by the estimator fit)
+    :param labels: an optional dictionary for relabeling column names
+    :param replicates: the number of bootstrap replicates
+    :param statistic: an optional function applied to each replicate result (must be a module level function when using multiple workers)
+    :param workers: the number of worker processes (default is the number of CPUs, 1 computes in-process)
+    :param seed: seed (or numpy SeedSequence) for the reproducible generation of replicates
+    :param batch_size: the number of replicates computed per random stream / task
+    :type replicates: int
+    :type workers: int
+    :type batch_size: int
+
+    :returns: numpy array with the replicates stacked along the first axis
+
+    .. note:: Replicates depend only on the seed and batch_size, not on the number of workers
+
+    """
+    owner, cells, entity_count, cell_count = estimator.entity_contributions(data, labels)
+
+    batch_count = -(-replicates // batch_size)
+    sizes = [min(batch_size, replicates - b * batch_size) for b in range(batch_count)]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(batch_count)
+
+    initargs = (estimator, owner, cells, entity_count, cell_count, statistic)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        _initialize_replicates(*initargs)
+        try:
+            batches = [_replicate_batch(s, n) for s, n in zip(seeds, sizes)]
+        finally:
+            _replicate_inputs.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_replicates,
+                                 initargs=initargs) as pool:
+            batches = list(pool.map(_replicate_batch, seeds, sizes))
+
+    return np.concatenate(batches)
+
+
+def bootstrap_confint(samples, alpha=0.05):
+    """
+    Percentile confidence intervals from bootstrap replicates
+
+    :param samples: replicates stacked along the first axis (as returned by entity_bootstrap)
+    :param alpha: significance level
+    :returns: confint_lower, confint_upper
+    """
+    confint_lower = np.quantile(samples, alpha / 2, axis=0)
+    confint_upper = np.quantile(samples, 1 - alpha / 2, axis=0)
+    return confint_lower, confint_upper
+
+
+def cumulative_matrices(matrix_set):
+    """
+    Cumulate a family of period transition matrices into multi-period matrices. Can be used as the
+    bootstrap statistic of the cohort estimator to obtain uncertainty for cumulative quantities.
+
+    :param matrix_set: three dimensional array object (From State, To State, Period)
+    :returns: three dimensional array object (From State, To State, Period) with the cumulative matrices
+    """
+    cumulative = np.empty_like(matrix_set)
+    cumulative[:, :, 0] = matrix_set[:, :, 0]
+    for k in range(1, matrix_set.shape[2]):
+        cumulative[:, :, k] = cumulative[:, :, k - 1] @ matrix_set[:, :, k]
+    return cumulative
@@ -0,0 +1,170 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Persistent cache of estimation results
+
+Estimation results are stored in a local directory, keyed by a content hash of the input data together with the
+estimator configuration and the fit arguments. Repeated estimations on unchanged data and parameters are loaded
+from the cache instead of being recomputed.
+
+* the content hash is computed with the vectorized pandas row hashing (hash_pandas_object)
+* the least recently used entries are evicted when the number of entries or the total size exceeds the limits
+
+.. warning:: Cache entries are pickled estimator states. Only use cache directories that are under your control
+
+"""
+
+from __future__ import print_function
+
+import hashlib
+import inspect
+import os
+import pickle
+
+import numpy as np
+
+from transitionMatrix.statespaces.statespace import StateSpace
+from transitionMatrix.utils.profiling import dataset_fingerprint
+
+
+def _canonical(value):
+    """ A deterministic representation of configuration values (used for hashing) """
+    if isinstance(value, StateSpace):
+        return 'StateSpace', _canonical(getattr(value, 'definition', [])), _canonical(value.absorbing), value.sticky
+    if hasattr(value, '__array__') and not isinstance(value, np.ndarray):
+        # array-likes (pandas index, series etc.) are hashed by content, their repr may be abbreviated
+        value = np.asarray(value)
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'O':
+            return 'ndarray', value.dtype.str, value.shape, _canonical(value.tolist())
+        return 'ndarray', value.dtype.str, value.shape, hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _canonical(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    if callable(value):
+        return getattr(value, '__module__', ''), getattr(value, '__qualname__', repr(value))
+    return repr(value)
+
+
+def _configuration(estimator):
+    """
+    The constructor configuration of an estimator (the values of its constructor arguments, fit results are
+    excluded). The ci argument is stored as the ci_method and ci_alpha attributes
+    """
+    configuration = {}
+    for name in inspect.signature(type(estimator).__init__).parameters:
+        if name == 'self':
+            continue
+        if name == 'ci':
+            configuration[name] = (estimator.ci_method, estimator.ci_alpha)
+        else:
+            configuration[name] = getattr(estimator, name, None)
+    return configuration
+
+
+class ResultCache(object):
+    """
+    A directory of persisted estimation results with least recently used eviction
+
+    :Example:
+
+    .. code-block:: python
+
+        cache = ResultCache('.tm_cache', max_entries=100)
+        result = cache.fit(myEstimator, data, labels=labels)
+
+    """
+
+    def __init__(self, directory, max_entries=None, max_bytes=None):
+        """
+        :param directory: the cache directory (created if it does not exist)
+        :param max_entries: the maximum number of cached results (optional)
+        :param max_bytes: the maximum total size of the cached results in bytes (optional)
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, estimator, data, **fit_arguments):
+        """
+        The cache key of an estimation: the dataset fingerprint, the estimator class and its constructor
+        configuration and the fit arguments
+        """
+        configuration = _configuration(estimator)
+        digest = hashlib.sha256()
+        digest.update(dataset_fingerprint(data).encode())
+        digest.update((type(estimator).__module__ + '.' + type(estimator).__qualname__).encode())
+        digest.update(repr(_canonical(configuration)).encode())
+        digest.update(repr(_canonical(fit_arguments)).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def fit(self, estimator, data, **fit_arguments):
+        """
+        Fit an estimator, or load the result and the estimator state from the cache if the same estimation was
+        done before
+
+        :param estimator: a configured estimator (its state is updated as with a regular fit)
+        :param data: the dataframe with the estimation data
+        :param fit_arguments: the arguments of the estimator fit method (e.g. labels)
+        :returns: the estimator fit result
+        """
+        key = self.key(estimator, data, **fit_arguments)
+        path = self._path(key)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+            self.hits += 1
+            estimator.__dict__.update(entry['state'])
+            return entry['result']
+
+        self.misses += 1
+        result = estimator.fit(data, **fit_arguments)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'result': result, 'state': estimator.__getstate__()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        self.evict()
+        return result
+
+    def entries(self):
+        """ The cached entries as (path, size, last use time) tuples, most recently used first """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((os.path.join(self.directory, name), stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e[2], reverse=True)
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is within its limits """
+        entries = self.entries()
+        total = 0
+        for count, (path, size, used) in enumerate(entries):
+            total += size
+            if (self.max_entries is not None and count >= self.max_entries) or \
+                    (self.max_bytes is not None and total > self.max_bytes):
+                os.remove(path)
+
+    def clear(self):
+        """ Remove all cached entries """
+        for path, size, used in self.entries():
+            os.remove(path)
@@ -15,65 +15,338 @@
 from __future__ import print_function
 
 import numpy as np
-import statsmodels.stats.proportion as st
+import pandas as pd
+from scipy import sparse
 
-import transitionMatrix
-from transitionMatrix.estimators import BaseEstimator
+from transitionMatrix.estimators import BaseEstimator, instrumented
+from transitionMatrix.estimators.transition_counts import TransitionCounts
+from transitionMatrix.utils.confidence import CONFINT_METHODS
 
 
 class CohortEstimator(BaseEstimator):
     """
     Class for implementing a Cohort Estimator for the transition matrix
 
+    By default the Time column of the data holds the cohort index of each observation (as produced by
+    bin_timestamps). With assign_cohorts=True the Time column holds the actual (real valued or datetime) observation
+    times, which are assigned to cohorts directly (see cohort_index). The cohort bounds may then be irregular or
+    calendar aligned (e.g. pd.date_range(start, end, freq='QS')).
+
     Documentation: `Cohort Estimator <https://www.openriskmanual.org/wiki/Cohort_Estimator>`_
 
     """
 
-    def __init__(self, cohort_bounds=None, states=None, ci=None):
+    def __init__(self, cohort_bounds=None, states=None, ci=None, assign_cohorts=False):
         BaseEstimator.__init__(self)
         # if not (0 < alpha <= 1.):
         #     raise ValueError('alpha parameter must be between 0 and 1.')
         self.cohort_bounds = cohort_bounds
+        self.assign_cohorts = assign_cohorts
         if states is not None:
             self.states = states
         if ci is not None:
-            assert (ci['method'] in ['goodman', 'sison-glaz', 'binomial'])
+            assert (ci['method'] in CONFINT_METHODS)
             assert (0 < ci['alpha'] <= 1.0)
             self.ci_method = ci['method']
             self.ci_alpha = ci['alpha']
+        # accumulated state of an incremental (partial_fit) estimation
+        self._partial_counts = None
+        self._partial_nans = 0
+        self._partial_tail = None
+        # results of a segmented estimation
+        self.segments = None
+        self.segment_counts = None
+        self.segment_matrices = None
 
     def get_average(self):
         return self.average_matrix
 
+    @instrumented
     def fit(self, data, labels=None):
         """
         Parameters
         ----------
         data : dataframe - The data to use for the estimation (in sorted by ID in compact format)
 
-        labels: an optional dictionary for relabeling column names
+        labels: an optional dictionary for relabeling column names. If it contains a Segment entry, a transition matrix set is estimated for each value of the segment column (see segment_matrices)
 
         Returns
         -------
-        matrix_set : An estimated transition matrix set
+        matrix_set : An estimated transition matrix set (or the segment_matrices array if a segment label is given)
 
         Notes
         ------
 
-        * loop over data rows (id, timepoint, state)
+        * extract data columns (id, timepoint, state) into arrays
         * at least two distinct timepoints are required (initial and final)
         * calculate population count N^i_k per state i per timepoint k
         * calculate migrations count N^{ij}_{kl} from i to j from timepoint k to timepoint l
         * calculate transition matrix as ratio T^{ij}_{kl} = N^{ij}_{kl} / N^i_k
         * calculate also count-averaged matrix
+        * all counts are obtained with a single bincount over the flattened (state, timepoint) and (from, to, period) index
 
         References
         ----------
 
 
         """
+        with self._phase('ingestion', rows=len(data)):
+            event_arrays = self._event_arrays(data, labels)
+        if labels is not None and labels.get('Segment') is not None:
+            with self._phase('segments', rows=len(data)):
+                return self._fit_segments(event_arrays, data[labels['Segment']].to_numpy())
+        return self._fit_events(event_arrays)
+
+    @instrumented
+    def fit_arrays(self, entity_id, event_time, entity_state, segment=None):
+        """
+        Estimate the transition matrices from event arrays instead of a dataframe (e.g. columns held by a feature
+        store). Any array-like or buffer protocol object (memoryview, array.array) is accepted; contiguous numpy
+        arrays (integer states, float times) are used without copies. The result is identical to fit.
+
+        :param entity_id: array of entity identifiers (sorted by ID in compact format)
+        :param event_time: array of observation times (cohort indexes, or actual times if assign_cohorts=True)
+        :param entity_state: array of states (state indexes or labels)
+        :param segment: (optional) array of segment keys (see fit with a Segment label)
+
+        :returns: matrix_set : An estimated transition matrix set (or segment_matrices if segments are given)
+        """
+        with self._phase('ingestion', rows=len(entity_id)):
+            event_arrays = self._encode_events(entity_id, event_time, entity_state)
+        if segment is not None:
+            with self._phase('segments', rows=len(entity_id)):
+                return self._fit_segments(event_arrays, segment)
+        return self._fit_events(event_arrays)
+
+    def _fit_events(self, event_arrays):
+        self._partial_counts = None
+        self._partial_fit_events(event_arrays)
+        return self.finalize()
+
+    @instrumented
+    def partial_fit(self, data, labels=None):
+        """
+        Accumulate the counts of a chunk of data. Chunks must be successive parts of the complete dataset (sorted by ID
+        in compact format), for example as produced by pd.read_csv(..., chunksize=n). Entity histories may span
+        chunk boundaries. Call finalize() after the last chunk to compute the transition matrices. When observation
+        times are assigned to cohorts (assign_cohorts=True) entity histories must not be split across chunks.
+
+        :param data: dataframe with a chunk of the data
+        :param labels: an optional dictionary for relabeling column names
+
+        :returns: the estimator
+
+        :Example:
+
+        .. code-block:: python
+
+            for chunk in pd.read_csv(file, chunksize=100000):
+                myEstimator.partial_fit(chunk)
+            myEstimator.finalize()
+
+        """
+        # store data in 1d arrays for faster processing
+        # capture nan events for missing observations
+        with self._phase('ingestion', rows=len(data)):
+            event_arrays = self._event_arrays(data, labels)
+        return self._partial_fit_events(event_arrays)
+
+    def _partial_fit_events(self, event_arrays):
+        if self._partial_counts is None:
+            self._partial_counts = np.zeros(self._cell_count(), dtype=int)
+            self._partial_nans = 0
+            self._partial_tail = None
+        self._partial_nans += int((~event_arrays[3]).sum())
+        if len(event_arrays[0]) == 0:
+            # an empty chunk leaves the carried over events unchanged
+            return self
+
+        # the last event of the previous chunk is counted together with its successor
+        if self._partial_tail is not None:
+            event_arrays = tuple(np.concatenate((tail[-1:], a)) for tail, a in zip(self._partial_tail, event_arrays))
+
+        # count all events in one pass over the flattened (state, timepoint) and (from, to, period) index
+        # store number of entities observed in given state per time step
+        # store number of entities observed to transition from state (From) to state (To) per period
+        with self._phase('counting', rows=len(event_arrays[0])):
+            event_index, cells = self._count_cells(*event_arrays, final=False)
+            self._partial_counts += np.bincount(cells, minlength=self._cell_count())
+        self._partial_tail = tuple(a[-2:] for a in event_arrays)
+
+        return self
+
+    @instrumented
+    def finalize(self):
+        """
+        Complete an incremental estimation (see partial_fit): handle the last event and compute the transition
+        matrices, averages and confidence intervals from the accumulated counts
+
+        :returns: matrix_set : An estimated transition matrix set
+        """
+        counts = self._partial_counts
+        if self._partial_tail is not None:
+            with self._phase('counting', rows=1):
+                event_index, cells = self._last_event_cells(*self._partial_tail)
+                counts = counts + np.bincount(cells, minlength=self._cell_count())
+        self.nans = self._partial_nans
+        self._partial_counts = None
+        self._partial_tail = None
+
+        return self.fit_counts(self._transition_counts(counts))
+
+    @instrumented
+    def fit_counts(self, transition_counts):
+        """
+        Estimate the transition matrices from (possibly merged) transition counts
+
+        :param transition_counts: TransitionCounts with (S, S, K) migrations and (S, K + 1) population counts
+
+        :returns: matrix_set : An estimated transition matrix set
+        """
+        self.transition_counts = transition_counts
+        tm_count = transition_counts.population
+        tmn_count = transition_counts.migrations
+        cohort_dim = transition_counts.periods
+
+        self.counts = int(tm_count.sum())
+
+        with self._phase('normalization', rows=self.counts):
+            # Normalization of counts to produce a family of probability matrices
+            tmn_values = transition_counts.matrices()
+
+            # Average transition matrix (assuming temporal homogeneity)
+            self.average_matrix = transition_counts.average()
+
+            # Return a list of transition matrices
+            # Both absolute (frequency) and relative (probability) format
+            for k in range(cohort_dim):
+                self.matrix_set.append(tmn_values[:, :, k])
+                self.count_set.append(tmn_count[:, :, k])
+
+            # Return absolute counts at time points
+            for k in range(tm_count.shape[1]):
+                self.count_normalization.append(tm_count[:, k])
+
+        # Confidence Interval Estimation (Based on Counts)
+        if self.ci_method:
+            with self._phase('confidence'):
+                self.confint_lower, self.confint_upper = transition_counts.confint(method=self.ci_method,
+                                                                                   alpha=self.ci_alpha)
+
+        return self.matrix_set
+
+    def _fit_segments(self, event_arrays, segment):
+        """
+        Estimate the transition matrices of all segments in a single counting pass. The result for each segment is
+        identical to fitting the rows of that segment separately.
+
+        * segment_counts: sparse (Segment, Count Cell) matrix of the flattened count vectors (see _count_cells)
+        * segment_matrices: four dimensional array object (Segment, Cohort, From State, To State)
+
+        :returns: segment_matrices
+        """
+        state_dim = self.states.cardinality
+        cohort_dim = len(self.cohort_bounds) - 1
+        cell_count = self._cell_count()
+
+        entity_id, entity_state, event_time, event_exists = event_arrays
+        segment, self.segments = pd.factorize(np.asarray(segment), sort=True)
+        segment_dim = len(self.segments)
+        self.nans = int((~event_exists).sum())
+
+        # group the rows of each segment (preserving their order), entity histories are split by segment
+        order = np.argsort(segment, kind='stable')
+        segment = segment[order]
+        entity_key = pd.factorize(entity_id)[0][order] * segment_dim + segment
+        entity_state = entity_state[order]
+        event_time = event_time[order]
+        event_exists = event_exists[order]
+        event_count = len(segment)
+
+        event_index, cells = self._count_cells(entity_key, entity_state, event_time, event_exists, final=False)
+        cells = [segment[event_index] * cell_count + cells]
+        weights = [np.ones(len(event_index), dtype=int)]
+
+        # the last event of each segment is evaluated in comparison with its previous one
+        last = np.flatnonzero(np.r_[segment[1:] != segment[:-1], event_count > 0])
+        last = last[event_exists[last]]
+        state = entity_state[last].astype(int)
+        time = event_time[last].astype(int)
+        if (time == 0).any():
+            raise ValueError('The last event of segment ' + str(self.segments[segment[last[time == 0][0]]])
+                             + ' is at the first timepoint (there is no previous timepoint)')
+        offset = segment[last] * cell_count
+        counted = last != event_count - 1
+        cells += [offset[counted] + state[counted] * (cohort_dim + 1) + time[counted],
+                  offset + state * (cohort_dim + 1) + time - 1]
+        weights += [- np.ones(counted.sum(), dtype=int), np.ones(len(last), dtype=int)]
+        previous = last - 1
+        migrated = (previous >= 0) & (entity_key[np.maximum(previous, 0)] == entity_key[last]) \
+            & event_exists[np.maximum(previous, 0)]
+        previous_state = entity_state[previous[migrated]].astype(int)
+        cells.append(offset[migrated] + state_dim * (cohort_dim + 1)
+                     + (previous_state * state_dim + state[migrated]) * cohort_dim + time[migrated] - 1)
+        weights.append(np.ones(migrated.sum(), dtype=int))
+
+        # sparse storage: only cells with observations are kept
+        cells, cell_index = np.unique(np.concatenate(cells), return_inverse=True)
+        values = np.bincount(cell_index.reshape(-1), weights=np.concatenate(weights)).astype(int)
+        nonzero = values != 0
+        cells = cells[nonzero]
+        self.segment_counts = sparse.csr_matrix((values[nonzero], (cells // cell_count, cells % cell_count)),
+                                                shape=(segment_dim, cell_count))
+        self.counts = int(values[nonzero][cells % cell_count < state_dim * (cohort_dim + 1)].sum())
+
+        # Normalization of the migration counts of each segment by the state counts of the segment
+        split = state_dim * (cohort_dim + 1)
+        population = self.segment_counts[:, :split].toarray().reshape((segment_dim, state_dim, cohort_dim + 1))
+        migration = self.segment_counts[:, split:].tocoo()
+        from_state = migration.col // (state_dim * cohort_dim)
+        to_state = (migration.col // cohort_dim) % state_dim
+        cohort = migration.col % cohort_dim
+        normalization = population[migration.row, from_state, cohort]
+        self.segment_matrices = np.zeros((segment_dim, cohort_dim, state_dim, state_dim), dtype=float)
+        self.segment_matrices[migration.row, cohort, from_state, to_state] = np.divide(
+            migration.data, normalization, out=np.zeros(len(migration.data)), where=normalization > 0)
+
+        return self.segment_matrices
+
+    def segment_transition_counts(self, segment):
+        """
+        The transition counts of one segment of a segmented estimation
+
+        :param segment: the segment key
+        :returns: TransitionCounts
+        """
+        g = list(self.segments).index(segment)
+        return self._transition_counts(self.segment_counts[g].toarray().reshape(-1))
+
+    def _shard_counts(self, event_arrays):
+        """ Counts of a shard of entities. All events (including the last one of the shard) count towards the population """
+        entity_id, entity_state, event_time, event_exists = event_arrays
+        event_index, cells = self._count_cells(*event_arrays, final=False)
+        counts = np.bincount(cells, minlength=self._cell_count())
+        if len(entity_id) > 0 and event_exists[-1]:
+            counts[int(entity_state[-1]) * len(self.cohort_bounds) + int(event_time[-1])] += 1
+        return counts
+
+    def _fit_shards(self, counts, event_arrays):
+        """ Replace the population count of the last event of the complete data with the last event treatment """
+        entity_id, entity_state, event_time, event_exists = event_arrays
+        counts = counts.copy()
+        if len(entity_id) > 0 and event_exists[-1]:
+            counts[int(entity_state[-1]) * len(self.cohort_bounds) + int(event_time[-1])] -= 1
+        event_index, cells = self._last_event_cells(*(a[-2:] for a in event_arrays))
+        counts += np.bincount(cells, minlength=self._cell_count())
+        self.nans = int((~event_exists).sum())
+        return self.fit_counts(self._transition_counts(counts))
+
+    def _event_arrays(self, data, labels=None):
+        """
+        Extract the event data of a compact format dataframe into 1d arrays. States are encoded with the state
+        space (state indexes or labels). Rows with missing state or time are flagged as not existing.
 
-        # Allow for flexible labelling for dataframe columns
+        """
         if labels is not None:
             state_label = labels['State']
             timestep_label = labels['Time']
@@ -83,129 +356,182 @@ class CohortEstimator(BaseEstimator):
             id_label = 'ID'
             timestep_label = 'Time'
 
-        # Old way of enumerating cohort intervals was using labels
-        # cohort_labels = data[timestep_label].unique()
-        # cohort_dim = len(cohort_labels) - 1
+        return self._encode_events(data[id_label].to_numpy(), data[timestep_label].to_numpy(),
+                                   data[state_label].to_numpy())
+
+    def _encode_events(self, entity_id, event_time, entity_state):
+        """
+        Convert event arrays into the estimator representation: encoded states, float times (or cohort indexes)
+        and the existence flag of each event. Numeric inputs are not copied.
+
+        """
+        entity_id = np.asarray(entity_id)
+        entity_state = self.states.encode(np.asarray(entity_state))
+        if self.assign_cohorts:
+            event_time = self.cohort_index(np.asarray(event_time))
+        else:
+            event_time = np.asarray(event_time)
+            if event_time.dtype.kind not in 'iuf':
+                event_time = pd.to_numeric(pd.Series(event_time), errors='coerce').to_numpy()
+            event_time = event_time.astype(float, copy=False)
+        event_exists = ~(np.isnan(entity_state) | np.isnan(event_time))
+
+        if self.assign_cohorts:
+            entity_id, entity_state, event_time, event_exists = self._cohort_states(entity_id, entity_state,
+                                                                                    event_time, event_exists)
+
+        return entity_id, entity_state, event_time, event_exists
+
+    def cohort_index(self, event_times):
+        """
+        Assign observation times to cohort bounds: an observation in the interval (b_{k-1}, b_k] is assigned to
+        bound k (the first bound that is not earlier than the time), hence the state at bound k is the last
+        observed state up to b_k. This is the assignment used by bin_timestamps. Times may be real valued or
+        datetime (in which case the cohort bounds must be datetime as well).
+
+        :param event_times: array-like of observation times
+        :returns: float array of cohort indexes (nan for missing times, -1 for times outside the cohort bounds)
+        """
+        event_times = pd.Series(event_times)
+        if pd.api.types.is_datetime64_any_dtype(event_times):
+            times = event_times.to_numpy(dtype='datetime64[ns]')
+            missing = np.isnat(times)
+            times = times.astype('int64').astype(float)
+            times[missing] = np.nan
+            bounds = pd.to_datetime(self.cohort_bounds).to_numpy(dtype='datetime64[ns]').astype('int64').astype(float)
+        else:
+            times = pd.to_numeric(event_times, errors='coerce').to_numpy(dtype=float)
+            bounds = np.asarray(self.cohort_bounds, dtype=float)
+        if (np.diff(bounds) <= 0).any():
+            raise ValueError('Cohort bounds must be strictly increasing')
+        index = np.searchsorted(bounds, times, side='left').astype(float)
+        index[(times < bounds[0]) | (times > bounds[-1])] = -1
+        index[np.isnan(times)] = np.nan
+        return index
+
+    def _cohort_states(self, entity_id, entity_state, event_time, event_exists):
+        """
+        Convert observations with assigned cohort indexes into the state of each entity at each cohort bound
+
+        * only the last observation of an entity up to a bound is retained
+        * the last known state is carried forward to subsequent bounds without observations (up to the final bound)
 
-        # The size of the state space
+        """
+        cohort_dim = len(self.cohort_bounds) - 1
+        event_count = len(entity_id)
+
+        superseded = np.zeros(event_count, dtype=bool)
+        superseded[:-1] = event_exists[:-1] & event_exists[1:] & (entity_id[1:] == entity_id[:-1]) \
+            & (event_time[1:] == event_time[:-1])
+        retained = ~superseded
+        entity_id = entity_id[retained]
+        entity_state = entity_state[retained]
+        event_time = event_time[retained]
+        event_exists = event_exists[retained]
+
+        # each state lasts until the next observation of the same entity (or the final bound)
+        valid = np.flatnonzero(event_exists)
+        next_same = entity_id[valid[1:]] == entity_id[valid[:-1]]
+        end = np.full(len(valid), cohort_dim + 1, dtype=float)
+        end[:-1][next_same] = event_time[valid[1:]][next_same]
+        repeats = np.ones(len(entity_id), dtype=int)
+        repeats[valid] = np.maximum(end - event_time[valid], 1).astype(int)
+
+        start = np.cumsum(repeats) - repeats
+        offset = np.arange(repeats.sum()) - np.repeat(start, repeats)
+        event_time = np.repeat(event_time, repeats) + offset
+        return np.repeat(entity_id, repeats), np.repeat(entity_state, repeats), event_time, \
+            np.repeat(event_exists, repeats)
+
+    def _cell_count(self):
+        """ Size of the flattened count vector: state counts N^i_k followed by the migration counts N^{ij}_k """
         state_dim = self.states.cardinality
-        # The number of cohorts is the number of intervals
-        # Minimally two (initial and final)
         cohort_dim = len(self.cohort_bounds) - 1
-        event_count = data[id_label].count()
+        return state_dim * (cohort_dim + 1) + state_dim * state_dim * cohort_dim
 
-        # store data in 1d arrays for faster processing
-        # capture nan events for missing observations
-        event_exists = np.empty(event_count, int)
-        entity_id = np.empty(event_count, int)
-        entity_state = np.empty(event_count, int)
-        event_time = np.empty(event_count, int)
-        nan_count = 0
-
-        i = 0
-        for index, row in data.iterrows():
-            entity_id[i] = row[id_label]
-            try:
-                entity_state[i] = row[state_label]
-                event_time[i] = row[timestep_label]
-                event_exists[i] = 1  # indicates a valid (complete) data row
-            except ValueError:
-                entity_state[i] = -99999
-                event_time[i] = -99999
-                event_exists[i] = 0
-                nan_count += 1
-            i += 1
-        self.nans = nan_count
+    def _count_cells(self, entity_id, entity_state, event_time, event_exists, final=True):
+        """
+        Map events to the cells of the flattened count vector.
 
-        # store number of entities observed in given state per time step
-        tm_count = np.ndarray((state_dim, cohort_dim + 1), int)
-        # store number of entities observed to transition from state (From) to state (To) per period
-        tmn_count = np.ndarray((state_dim, state_dim, cohort_dim), int)
-        # store normalized frequencies
-        tmn_values = np.ndarray((state_dim, state_dim, cohort_dim), float)
-        # matrix to store average transitions
-        tmn_average = np.ndarray((state_dim, state_dim), float)
-
-        # initialize to zero (TODO ?)
-        tm_count.fill(0)
-        tmn_count.fill(0)
-        tmn_values.fill(0)
-        tmn_average.fill(0)
-
-        # TODO Capture case if entity with only one observation (hence no transition count)
-        # TODO Capture case with stale observations (no transitions)
-
-        for i in range(0, event_count - 1):  # the last point handled separately
-            if event_exists[i] == 1:
-                # while processing valid event data from same entity
-                # increment state count
-                tm_count[(entity_state[i], event_time[i])] += 1
-                if entity_id[i + 1] == entity_id[i]:
-                    # increment migration count if there is subsequent observation
-                    # NB: It does not have to be different
-                    tmn_count[(entity_state[i], entity_state[i + 1], event_time[i])] += 1
-
-        # handle boundary cases
-        # the last event must be evaluated in comparison with its previous one
-        i = event_count - 1
-        if event_exists[i] == 1:
-            # ATTN we must shift the time index of the tm_count, tmn_count
-            tm_count[(entity_state[i], event_time[i] - 1)] += 1
-            if entity_id[i] == entity_id[i - 1]:
-                tmn_count[(entity_state[i - 1], entity_state[i], event_time[i] - 1)] += 1
-
-        # print(tm_count)
-        # print(tm_count.sum())
-        # print(tmn_count[:, :, 0])
+        * each valid event increments the state count of its timepoint
+        * each valid event followed by a valid event of the same entity increments the migration count
+        * the last event is evaluated in comparison with its previous one (at the previous timepoint)
 
-        self.counts = int(tm_count.sum())
+        If final is False the last event is not counted (it is carried over to the next chunk of data)
 
-        # Normalization of counts to produce a family of probability matrices
-        for s1 in range(state_dim):
-            for s2 in range(state_dim):
-                for k in range(cohort_dim):
-                    if tm_count[(s1, k)] > 0:
-                        tmn_values[(s1, s2, k)] = tmn_count[(s1, s2, k)] / tm_count[(s1, k)]
-
-        # for k in range(cohort_dim):
-        #     m = transitionMatrix.TransitionMatrix(tmn_values[:, :, k])
-        #     m.print_matrix(accuracy=3)
-
-        # Average transition matrix (assuming temporal homogeneity)
-        for s1 in range(state_dim):
-            for s2 in range(state_dim):
-                tm_total_count = 0
-                for k in range(cohort_dim):
-                    tmn_average[(s1, s2)] += tmn_count[(s1, s2, k)]
-                    tm_total_count += tm_count[(s1, k)]
-                if tm_total_count > 0:
-                    tmn_average[(s1, s2)] /= tm_total_count
-        self.average_matrix = tmn_average
+        :returns: the index of the contributing event and the count cell
 
-        # Confidence Interval Estimation (Based on Counts)
-        confint_lower = np.ndarray((state_dim, state_dim, cohort_dim))
-        confint_upper = np.ndarray((state_dim, state_dim, cohort_dim))
-        for k in range(cohort_dim - 1):
-            for s1 in range(state_dim):
-                intervals = st.multinomial_proportions_confint(tmn_count[s1, :, k], alpha=self.ci_alpha,
-                                                               method=self.ci_method)
-                for s2 in range(state_dim):
-                    confint_lower[s1, s2, k] = intervals[s2][0]
-                    confint_upper[s1, s2, k] = intervals[s2][1]
-            self.confint_lower = confint_lower
-            self.confint_upper = confint_upper
-
-        # Return a list of transition matrices
-        # Both absolute (frequency) and relative (probability) format
-        for k in range(cohort_dim):
-            self.matrix_set.append(tmn_values[:, :, k])
-            self.count_set.append(tmn_count[:, :, k])
-
-
-        # Return absolute counts at time points
-        for k in range(cohort_dim + 1):
-            self.count_normalization.append(tm_count[:, k])
-
-        # print(self.count_normalization)
+        """
+        state_dim = self.states.cardinality
+        cohort_dim = len(self.cohort_bounds) - 1
 
-        return self.matrix_set
+        state = np.where(event_exists, entity_state, 0).astype(int)
+        time = np.where(event_exists, event_time, 0).astype(int)
+        if event_exists.any() and (time[event_exists].min() < 0 or time[event_exists].max() > cohort_dim):
+            raise ValueError('Observation times are outside the range of cohort intervals')
+
+        # state counts (all but the last event)
+        populated = np.flatnonzero(event_exists[:-1])
+        population_cells = state[populated] * (cohort_dim + 1) + time[populated]
+
+        # migration counts to the subsequent observation of the same entity
+        # NB: It does not have to be different
+        migrated = np.flatnonzero(event_exists[:-1] & event_exists[1:] & (entity_id[1:] == entity_id[:-1]))
+        migration_cells = state_dim * (cohort_dim + 1) \
+            + (state[migrated] * state_dim + state[migrated + 1]) * cohort_dim + time[migrated]
+
+        event_index = [populated, migrated]
+        cells = [population_cells, migration_cells]
+
+        if final:
+            last_index, last_cells = self._last_event_cells(entity_id, entity_state, event_time, event_exists)
+            event_index.append(last_index)
+            cells.append(last_cells)
+
+        return np.concatenate(event_index).astype(int), np.concatenate(cells).astype(int)
+
+    def _last_event_cells(self, entity_id, entity_state, event_time, event_exists):
+        """
+        Handle boundary cases: the last event must be evaluated in comparison with its previous one
+
+        :returns: the index of the contributing event and the count cell
+        """
+        state_dim = self.states.cardinality
+        cohort_dim = len(self.cohort_bounds) - 1
+
+        event_index = []
+        cells = []
+        # ATTN we must shift the time index of the last event
+        i = len(entity_id) - 1
+        if i >= 0 and event_exists[i]:
+            state = int(entity_state[i])
+            time = int(event_time[i])
+            if time == 0:
+                raise ValueError('The last event is at the first timepoint (there is no previous timepoint)')
+            event_index.append(i)
+            cells.append(state * (cohort_dim + 1) + time - 1)
+            if i > 0 and event_exists[i - 1] and entity_id[i] == entity_id[i - 1]:
+                event_index.append(i)
+                cells.append(state_dim * (cohort_dim + 1)
+                             + (int(entity_state[i - 1]) * state_dim + state) * cohort_dim + time - 1)
+
+        return np.array(event_index, dtype=int), np.array(cells, dtype=int)
+
+    def _transition_counts(self, counts):
+        """ Reshape a flattened count vector (see _count_cells) into TransitionCounts """
+        state_dim = self.states.cardinality
+        cohort_dim = len(self.cohort_bounds) - 1
+        split = state_dim * (cohort_dim + 1)
+        tm_count = counts[:split].reshape((state_dim, cohort_dim + 1))
+        tmn_count = counts[split:].reshape((state_dim, state_dim, cohort_dim))
+        return TransitionCounts(tmn_count, tm_count)
+
+    def estimate_from_counts(self, counts):
+        """
+        Compute the family of transition matrices from a flattened count vector (see _count_cells). Counts may
+        be weighted (non-integer), as is the case for bootstrap replicates.
+
+        :returns: tmn_values: three dimensional array object (From State, To State, Cohort)
+
+        """
+        return self._transition_counts(counts).matrices()
@@ -14,8 +14,151 @@
 
 from __future__ import print_function
 
+import numpy as np
+
+from transitionMatrix.creditratings.creditcurve import CreditCurve
 from transitionMatrix.estimators import DurationEstimator
 
 
 class KaplanMeierEstimator(DurationEstimator):
-    pass
+
+    """
+    Class for implementing the Kaplan-Meier estimator of survival (time to absorption) curves per initial state.
+    For credit rating data these are the credit (default) curves per initial rating.
+
+    Documentation: `Kaplan-Meier Estimator <https://www.openriskmanual.org/wiki/Kaplan-Meier_Estimator>`_
+
+    """
+
+    def __init__(self, states=None, binning=None):
+        DurationEstimator.__init__(self, binning=binning)
+        if states is not None:
+            self.states = states
+        self.survival = None
+        self.times = None
+        self.credit_curves = None
+
+    def fit(self, data, labels=None, absorbing_state=None, timepoints=None, end_time=None, start_time=None):
+        """
+        Parameters
+        ----------
+        data : dataframe - The data to use for the estimation in canonical format (one row per observed transition), with the following columns (or pass a label object that will assign accordingly):
+
+            * ID: A unique entity identification number
+            * Time: Time when a transition occurs
+            * From: State from where a transition occurs
+            * To: State to which a transition occurs
+
+        labels: an optional dictionary for relabeling column names if those deviate from the convention
+        absorbing_state: the absorbing (e.g. default) state. The default is the first absorbing state of the state space, or else the last state
+        timepoints: optional durations at which to evaluate the curves. The default is all distinct durations to absorption
+        end_time: optional end of the observation window. Entities that are not absorbed are censored at end_time (the default is their last observation)
+        start_time: optional start of the observation window. Durations are measured from start_time (the default is the first observation of each entity)
+
+        Returns
+        -------
+        credit_curves : CreditCurve with the probability of absorption (one minus survival) per initial state (rows) and duration (columns)
+
+        Notes
+        ------
+
+        * the initial state of an entity is the From state of its first observation
+        * durations are measured from the first observation of each entity, unless start_time is given. For data without an initial (entry) observation per entity, e.g. one row per transition, an entity absorbed at its first row would have zero duration: such data require start_time
+        * the risk set sizes of all initial states are obtained in one pass as reverse cumulative sums of (initial state, duration) counts
+
+        """
+        if labels is not None:
+            from_label = labels['From']
+            to_label = labels['To']
+            timestep_label = labels['Time']
+            id_label = labels['ID']
+        else:
+            from_label = 'From'
+            to_label = 'To'
+            id_label = 'ID'
+            timestep_label = 'Time'
+
+        state_dim = self.states.cardinality
+        # the absorbing state may be a state index or a state label, it is compared with the encoded states
+        if absorbing_state is None:
+            if self.states.absorbing:
+                absorbing_state = int(self.states.encode([self.states.absorbing[0]])[0])
+            else:
+                absorbing_state = state_dim - 1
+        else:
+            absorbing_state = int(self.states.encode([absorbing_state])[0])
+
+        entity_id = data[id_label].values
+        event_time = self.bin_times(data[timestep_label].values)
+        event_from_state = self.states.encode(data[from_label])
+        event_to_state = self.states.encode(data[to_label])
+
+        # Capture nan events for potentially missing observations
+        event_exists = ~(np.isnan(event_from_state) | np.isnan(event_to_state) | np.isnan(event_time))
+        self.nans = int((~event_exists).sum())
+        self.counts = len(entity_id)
+
+        order = np.lexsort((event_time[event_exists], entity_id[event_exists]))
+        entity_id = entity_id[event_exists][order]
+        event_time = event_time[event_exists][order]
+        event_from_state = event_from_state[event_exists][order].astype(int)
+        event_to_state = event_to_state[event_exists][order].astype(int)
+
+        # Entity level quantities: initial state, entry time, exit time and absorption flag
+        new_entity = np.ones(len(entity_id), dtype=bool)
+        new_entity[1:] = entity_id[1:] != entity_id[:-1]
+        entity_start = np.flatnonzero(new_entity)
+        entity_index = np.cumsum(new_entity) - 1
+        initial_state = event_from_state[entity_start]
+        if start_time is None:
+            entry_time = event_time[entity_start]
+        else:
+            if len(event_time) and event_time.min() < start_time:
+                raise ValueError('Observation times precede the start of the observation window')
+            entry_time = np.full(len(entity_start), start_time, dtype=float)
+        if end_time is None:
+            exit_time = np.maximum.reduceat(event_time, entity_start) if len(entity_start) else entry_time
+        else:
+            exit_time = np.full(len(entity_start), end_time, dtype=float)
+
+        absorbed_rows = np.flatnonzero(event_to_state == absorbing_state)
+        absorbed_entities, first_absorbed = np.unique(entity_index[absorbed_rows], return_index=True)
+        absorbed = np.zeros(len(entity_start), dtype=bool)
+        absorbed[absorbed_entities] = True
+        exit_time[absorbed_entities] = event_time[absorbed_rows[first_absorbed]]
+        duration = exit_time - entry_time
+
+        # Distinct durations to absorption
+        absorption_times = np.unique(duration[absorbed])
+        time_dim = len(absorption_times)
+
+        # Absorptions d[g, j] at the j-th distinct duration per initial state g
+        j = np.searchsorted(absorption_times, duration[absorbed])
+        d = np.bincount(initial_state[absorbed] * time_dim + j, minlength=state_dim * time_dim).reshape(
+            (state_dim, time_dim))
+
+        # Risk set n[g, j]: entities of initial state g with duration at least equal to the j-th distinct duration
+        p = np.searchsorted(absorption_times, duration, side='right')
+        exits = np.bincount(initial_state * (time_dim + 1) + p, minlength=state_dim * (time_dim + 1)).reshape(
+            (state_dim, time_dim + 1))
+        n = np.cumsum(exits[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+        hazard = np.zeros((state_dim, time_dim), dtype=float)
+        np.divide(d, n, out=hazard, where=n > 0)
+        survival = np.cumprod(1.0 - hazard, axis=1)
+
+        if timepoints is not None:
+            timepoints = np.asarray(timepoints, dtype=float)
+            idx = np.searchsorted(absorption_times, timepoints, side='right') - 1
+            if time_dim:
+                survival = np.where(idx >= 0, survival[:, np.maximum(idx, 0)], 1.0)
+            else:
+                survival = np.ones((state_dim, len(timepoints)))
+            self.times = list(timepoints)
+        else:
+            self.times = list(absorption_times)
+
+        self.survival = survival
+        self.credit_curves = CreditCurve(values=1.0 - survival)
+
+        return self.credit_curves
@@ -0,0 +1,120 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Multiprocess sharded estimation across entity partitions
+
+Entities are hash-partitioned by ID into shards, hence entity histories are never split. The counting phase of the
+estimator runs per shard in a process pool and the (additive) counts of all shards are summed before the
+estimator specific normalization.
+
+* event arrays are placed in shared memory once, workers receive only the shard boundaries
+* entity identifiers are encoded as integers before sharing (the original identifiers may be strings)
+
+Supported estimators: SimpleEstimator, CohortEstimator, AalenJohansenEstimator, TimeHomogeneousEstimator
+
+"""
+
+from __future__ import print_function
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Shard inputs are attached once per worker process (at pool initialization)
+_shard_inputs = {}
+
+
+def _initialize_shards(estimator, specs):
+    blocks = [shared_memory.SharedMemory(name=name) for name, shape, dtype in specs]
+    arrays = tuple(np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, (name, shape, dtype) in zip(blocks, specs))
+    _shard_inputs.update(estimator=estimator, blocks=blocks, arrays=arrays)
+
+
+def _count_shard(start, stop):
+    """ Count the events of the rows [start, stop) of the shared event arrays """
+    estimator = _shard_inputs['estimator']
+    return estimator._shard_counts(tuple(a[start:stop] for a in _shard_inputs['arrays']))
+
+
+def shard_index(entity_id, shards):
+    """
+    Assign entities to shards by hashing their identifier
+
+    :param entity_id: array of entity identifiers
+    :param shards: the number of shards
+    :type shards: int
+
+    :returns: array with the shard of each row
+    """
+    return (pd.util.hash_array(np.asarray(entity_id)) % np.uint64(shards)).astype(int)
+
+
+def sharded_fit(estimator, data, labels=None, workers=None, shards=None, **kwargs):
+    """
+    Fit an estimator by counting hash partitions (shards) of the entities in parallel
+
+    :param estimator: a configured estimator (SimpleEstimator, CohortEstimator, AalenJohansenEstimator or TimeHomogeneousEstimator)
+    :param data: the dataframe with the estimation data (in the format expected by the estimator fit)
+    :param labels: an optional dictionary for relabeling column names
+    :param workers: the number of worker processes (default is the number of CPUs, 1 computes in-process)
+    :param shards: the number of entity partitions (default is the number of workers)
+    :param kwargs: additional estimator specific arguments (e.g. end_time for the TimeHomogeneousEstimator)
+    :type workers: int
+    :type shards: int
+
+    :returns: the estimator fit result
+
+    .. note:: The result is identical to the estimator fit (up to floating point summation order of exposures)
+
+    """
+    event_arrays = estimator._event_arrays(data, labels)
+    # entity identifiers are encoded as integers (equality and ordering of sorted data are preserved)
+    entity_code = pd.factorize(event_arrays[0])[0]
+    estimator._prepare_shards(event_arrays, **kwargs)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if shards is None:
+        shards = workers
+
+    # stable reordering of rows by shard preserves the order of events within each entity
+    shard = shard_index(event_arrays[0], shards)
+    order = np.argsort(shard, kind='stable')
+    bounds = np.searchsorted(shard[order], np.arange(shards + 1))
+    shard_arrays = (entity_code[order],) + tuple(np.asarray(a)[order] for a in event_arrays[1:])
+
+    if workers == 1:
+        counts = sum(estimator._shard_counts(tuple(a[start:stop] for a in shard_arrays))
+                     for start, stop in zip(bounds[:-1], bounds[1:]))
+    else:
+        blocks = []
+        try:
+            specs = []
+            for a in shard_arrays:
+                block = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)[:] = a
+                specs.append((block.name, a.shape, a.dtype.str))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_shards,
+                                     initargs=(estimator, specs)) as pool:
+                counts = sum(pool.map(_count_shard, bounds[:-1], bounds[1:]))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    return estimator._fit_shards(counts, event_arrays)
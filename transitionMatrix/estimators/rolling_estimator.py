@@ -0,0 +1,111 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import numpy as np
+
+from transitionMatrix.estimators import BaseEstimator
+from transitionMatrix.estimators.cohort_estimator import CohortEstimator
+from transitionMatrix.estimators.transition_counts import TransitionCounts
+from transitionMatrix.utils.confidence import CONFINT_METHODS, multinomial_confint
+
+
+class RollingCohortEstimator(BaseEstimator):
+    """
+    Class for implementing a rolling window cohort estimator: the count averaged transition matrix over the most
+    recent window of cohorts
+
+    The migration and population counts of the cohorts in the window are kept in a ring buffer together with their
+    running sums. Adding the newest cohort (and evicting the oldest) updates the average matrix and its confidence
+    intervals without revisiting the other cohorts of the window. The window average is the single matrix of the
+    matrix set (with the period axis of the confidence intervals).
+
+    """
+
+    def __init__(self, window, states=None, ci=None):
+        BaseEstimator.__init__(self)
+        if states is not None:
+            self.states = states
+        if ci is not None:
+            assert (ci['method'] in CONFINT_METHODS)
+            assert (0 < ci['alpha'] <= 1.0)
+            self.ci_method = ci['method']
+            self.ci_alpha = ci['alpha']
+        assert (window > 0)
+        self.window = window
+        self.migration_buffer = None
+        self.population_buffer = None
+        self.migration_sum = None
+        self.population_sum = None
+        self.position = 0
+        self.cohorts = 0
+        if self.states is not None:
+            self._allocate(self.states.cardinality)
+
+    def _allocate(self, state_dim):
+        """ Ring buffer of per cohort counts and running sums over the window """
+        self.migration_buffer = np.zeros((self.window, state_dim, state_dim))
+        self.population_buffer = np.zeros((self.window, state_dim))
+        self.migration_sum = np.zeros((state_dim, state_dim))
+        self.population_sum = np.zeros(state_dim)
+
+    def get_average(self):
+        return self.average_matrix
+
+    def update(self, transition_counts):
+        """
+        Add the counts of the newest cohort(s) to the window, evicting the oldest cohort(s) if the window is full
+
+        :param transition_counts: TransitionCounts of one or more successive cohorts (in time order)
+
+        :returns: average_matrix : the count averaged transition matrix over the window
+        """
+        if self.migration_buffer is None:
+            self._allocate(transition_counts.migrations.shape[0])
+        for k in range(transition_counts.periods):
+            migrations = transition_counts.migrations[:, :, k]
+            population = transition_counts.population[:, k]
+            self.migration_sum += migrations - self.migration_buffer[self.position]
+            self.population_sum += population - self.population_buffer[self.position]
+            self.migration_buffer[self.position] = migrations
+            self.population_buffer[self.position] = population
+            self.position = (self.position + 1) % self.window
+            self.cohorts += 1
+
+        window_counts = TransitionCounts(self.migration_sum[:, :, np.newaxis], self.population_sum[:, np.newaxis])
+        self.transition_counts = window_counts
+        self.counts = int(round(self.population_sum.sum()))
+        self.average_matrix = window_counts.average()
+        self.matrix_set = [self.average_matrix]
+        if self.ci_method:
+            lower, upper = multinomial_confint(self.migration_sum, alpha=self.ci_alpha, method=self.ci_method, axis=1)
+            self.confint_lower = lower[:, :, np.newaxis]
+            self.confint_upper = upper[:, :, np.newaxis]
+        return self.average_matrix
+
+    def fit(self, data, cohort_bounds, labels=None):
+        """
+        Estimate the counts of the cohorts in a dataset (see CohortEstimator.fit) and add them to the window
+
+        :param data: dataframe with the cohort data (sorted by ID in compact format)
+        :param cohort_bounds: the cohort bounds of the data
+        :param labels: an optional dictionary for relabeling column names
+
+        :returns: average_matrix : the count averaged transition matrix over the window
+        """
+        estimator = CohortEstimator(cohort_bounds=cohort_bounds, states=self.states)
+        estimator.fit(data, labels=labels)
+        self.nans = estimator.nans
+        return self.update(estimator.transition_counts)
@@ -14,9 +14,11 @@
 
 from __future__ import print_function
 import numpy as np
+import pandas as pd
 
-from transitionMatrix.estimators import BaseEstimator
-import statsmodels.stats.proportion as st
+from transitionMatrix.estimators import BaseEstimator, instrumented
+from transitionMatrix.estimators.transition_counts import TransitionCounts
+from transitionMatrix.utils.confidence import CONFINT_METHODS
 
 
 class SimpleEstimator(BaseEstimator):
@@ -33,16 +35,24 @@ class SimpleEstimator(BaseEstimator):
         if states is not None:
             self.states = states
         if ci is not None:
-            assert (ci['method'] in ['goodman', 'sison-glaz', 'binomial'])
+            assert (ci['method'] in CONFINT_METHODS)
             self.ci_method = ci['method']
             self.ci_alpha = ci['alpha']
 
-    def fit(self, data):
+    @instrumented
+    def fit(self, data, labels=None):
         """
         Parameters
         ----------
-        data : array-like
-            The data to use for the estimation
+        data : dataframe - The data to use for the estimation, one row per observed transition. Without labels the
+            state in and state out are the third and fourth column of the data (LendingClub style format)
+
+        labels: an optional dictionary of column names with the following entries:
+
+            * ID: A unique entity identification number
+            * From: The state in
+            * To: The state out
+            * Weight: (optional) A weight column (e.g. exposure or balance) for weighted migration matrices
 
         Returns
         -------
@@ -53,79 +63,154 @@ class SimpleEstimator(BaseEstimator):
         Notes
         ------
 
-        * loop over data rows
         * expected format is (id, state_in, state_out)
         * calculate population count N^i_k per state i
         * calculate migrations count N^{ij}_{kl} from i to j
         * calculate transition matrix as ratio T^{ij}_{kl} = N^{ij}_{kl} / N^i_k
+        * counts (or weight sums) are obtained with a single bincount over the flattened (state) and (from, to) index
 
-        """
+        .. note:: Confidence intervals of weighted estimates are computed from the unit (event) counts, as the multinomial intervals do not apply to weight sums
 
+        """
         # In the simple estimator all events are part of the same cohort
-        state_count = self.states.cardinality
-        state_list = self.states.get_states()
-
-        # create storage for counts and transitions
-        tm_count = np.ndarray(state_count)
-        tmn_count = np.ndarray((state_count, state_count))
-        tm_count.fill(0.0)
-        tmn_count.fill(0.0)
-
-        i = 0
-        for row in data.itertuples(index=False):
-            # state_in = state_list.index(row[2])
-            # state_out = state_list.index(row[3])
-            state_in = row[2]
-            state_out = row[3]
-            tm_count[state_in] += 1
-            tmn_count[state_in, state_out] += 1
-            i += 1
-
-        self.counts = int(tm_count.sum())
+        with self._phase('ingestion', rows=len(data)):
+            event_arrays = self._event_arrays(data, labels)
+        return self._fit_events(event_arrays)
+
+    @instrumented
+    def fit_arrays(self, state_in, state_out, entity_id=None, weight=None):
+        """
+        Estimate the transition matrix from event arrays instead of a dataframe (e.g. columns held by a feature
+        store). Any array-like or buffer protocol object (memoryview, array.array) is accepted; contiguous numpy
+        arrays are used without copies. The result is identical to fit.
+
+        :param state_in: array of states in (state indexes or labels)
+        :param state_out: array of states out
+        :param entity_id: (optional) array of entity identifiers (the default is the row number)
+        :param weight: (optional) array of weights (e.g. exposure or balance)
+
+        :returns: matrix_set : the estimated transition matrix (in a list of one)
+        """
+        with self._phase('ingestion', rows=len(state_in)):
+            event_arrays = self._encode_events(state_in, state_out, entity_id, weight)
+        return self._fit_events(event_arrays)
+
+    def _fit_events(self, event_arrays):
+        with self._phase('counting', rows=len(event_arrays[0])):
+            counts = self._shard_counts(event_arrays)
+        return self._fit_shards(counts, event_arrays)
+
+    @instrumented
+    def fit_counts(self, transition_counts, event_counts=None):
+        """
+        Estimate the transition matrix from (possibly merged) single period transition counts
+
+        :param transition_counts: TransitionCounts with (S, S, 1) migrations and (S, 1) population counts
+        :param event_counts: (optional) the unweighted TransitionCounts of weighted transition counts, used for the confidence intervals
+
+        :returns: matrix_set : the estimated transition matrix (in a list of one)
+        """
+        self.transition_counts = transition_counts
+        total = transition_counts.population.sum()
+        self.counts = float(total) if transition_counts.population.dtype.kind == 'f' else int(total)
 
         if self.ci_method:
-            '''Confidence intervals for multinomial proportions. See the statsmodels URL
-            http://www.statsmodels.org/devel/_modules/statsmodels/stats/proportion.html
-    
-            Parameters
-            ----------
-            counts : array_like of int, 1-D
-                Number of observations in each category.
-            alpha : float in (0, 1), optional
-                Significance level, defaults to 0.05.
-            method : {'goodman', 'sison-glaz'}, optional
-                Method to use to compute the confidence intervals; available methods
-                are:
-    
-                 - `goodman`: based on a chi-squared approximation, valid if all
-                   values in `counts` are greater or equal to 5 [2]_
-                 - `sison-glaz`: less conservative than `goodman`, but only valid if
-                   `counts` has 7 or more categories (``len(counts) >= 7``) [3]_
-    
-            Returns
-            -------
-            confint : ndarray, 2-D
-                Array of [lower, upper] confidence levels for each category, such that
-                overall coverage is (approximately) `1-alpha`.
-            '''
-
-            confint_lower = np.ndarray((state_count, state_count, 1))
-            confint_upper = np.ndarray((state_count, state_count, 1))
-            for s1 in range(state_count):
-                intervals = st.multinomial_proportions_confint(tmn_count[s1, :], alpha=self.ci_alpha, method=self.ci_method)
-                for s2 in range(state_count):
-                    confint_lower[s1, s2, 0] = intervals[s2][0]
-                    confint_upper[s1, s2, 0] = intervals[s2][1]
-            self.confint_lower = confint_lower
-            self.confint_upper = confint_upper
+            # Confidence intervals for multinomial proportions (see transitionMatrix.utils.confidence)
+            with self._phase('confidence'):
+                if event_counts is None:
+                    event_counts = transition_counts
+                self.confint_lower, self.confint_upper = event_counts.confint(method=self.ci_method,
+                                                                              alpha=self.ci_alpha)
 
         # Normalization of counts to produce family of probability matrices
-        for s1 in range(state_count):
-            for s2 in range(state_count):
-                if tm_count[s1] > 0:
-                    tmn_count[(s1, s2)] = tmn_count[(s1, s2)] / tm_count[s1]
-
         # We store and return the matrix in matrix set (but there is only one instance)
-        self.matrix_set.append(tmn_count)
+        with self._phase('normalization', rows=self.counts):
+            self.matrix_set.append(transition_counts.matrices()[:, :, 0])
 
         return self.matrix_set
+
+    def _event_arrays(self, data, labels=None):
+        """
+        Extract the event data into 1d arrays. Without labels the states are the third and fourth column of the
+        data and each row is treated as a separate entity. Rows with missing states (or weights) are flagged as not
+        existing. Without a weight column all weights are one.
+
+        """
+        weight = None
+        if labels is not None:
+            entity_id = data[labels['ID']].to_numpy() if 'ID' in labels else data.index.to_numpy()
+            state_in = data[labels['From']].to_numpy()
+            state_out = data[labels['To']].to_numpy()
+            if labels.get('Weight') is not None:
+                weight = pd.to_numeric(data[labels['Weight']], errors='coerce').to_numpy(dtype=float)
+        else:
+            entity_id = data.index.to_numpy()
+            state_in = data.iloc[:, 2].to_numpy()
+            state_out = data.iloc[:, 3].to_numpy()
+        return self._encode_events(state_in, state_out, entity_id, weight)
+
+    def _encode_events(self, state_in, state_out, entity_id=None, weight=None):
+        """
+        Convert event arrays into the estimator representation: encoded states, the existence flag and the weight
+        of each event. Numeric inputs are not copied.
+
+        """
+        state_in = self.states.encode(np.asarray(state_in))
+        state_out = self.states.encode(np.asarray(state_out))
+        entity_id = np.arange(len(state_in)) if entity_id is None else np.asarray(entity_id)
+        event_exists = ~(np.isnan(state_in) | np.isnan(state_out))
+        if weight is None:
+            weight = np.ones(len(entity_id), dtype=int)
+        else:
+            weight = np.asarray(weight).astype(float, copy=False)
+            if (weight < 0).any():
+                raise ValueError('Weights must be non-negative')
+            event_exists &= ~np.isnan(weight)
+
+        return entity_id, state_in, state_out, event_exists, weight
+
+    def _cell_count(self):
+        """ Size of the flattened count vector: state counts N^i followed by the migration counts N^{ij} """
+        state_dim = self.states.cardinality
+        return state_dim + state_dim * state_dim
+
+    def _count_cells(self, entity_id, state_in, state_out, event_exists, weight=None):
+        """
+        Map events to the cells of the flattened count vector.
+
+        :returns: the index of the contributing event and the count cell
+        """
+        state_dim = self.states.cardinality
+        valid = np.flatnonzero(event_exists)
+        state_in = state_in[valid].astype(int)
+        state_out = state_out[valid].astype(int)
+        event_index = np.concatenate((valid, valid))
+        cells = np.concatenate((state_in, state_dim + state_in * state_dim + state_out))
+        return event_index, cells
+
+    def _transition_counts(self, counts):
+        """ Reshape a flattened count vector (see _count_cells) into TransitionCounts """
+        state_dim = self.states.cardinality
+        return TransitionCounts(counts[state_dim:].reshape((state_dim, state_dim, 1)),
+                                counts[:state_dim].reshape((state_dim, 1)))
+
+    def estimate_from_counts(self, counts):
+        """ Compute the transition matrix from a flattened count vector (see _count_cells) """
+        return self._transition_counts(counts).matrices()[:, :, 0]
+
+    def _shard_counts(self, event_arrays):
+        """ Counts (or weight sums) of the events """
+        weight = event_arrays[4]
+        event_index, cells = self._count_cells(*event_arrays)
+        if weight.dtype.kind == 'f':
+            return np.bincount(cells, weights=weight[event_index], minlength=self._cell_count())
+        return np.bincount(cells, minlength=self._cell_count())
+
+    def _fit_shards(self, counts, event_arrays):
+        self.nans = int((~event_arrays[3]).sum())
+        event_counts = None
+        if self.ci_method and event_arrays[4].dtype.kind == 'f':
+            # the confidence intervals of weighted estimates are based on the event counts
+            event_index, cells = self._count_cells(*event_arrays)
+            event_counts = self._transition_counts(np.bincount(cells, minlength=self._cell_count()))
+        return self.fit_counts(self._transition_counts(counts), event_counts=event_counts)
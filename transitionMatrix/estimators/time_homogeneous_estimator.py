@@ -0,0 +1,240 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+from transitionMatrix.estimators import DurationEstimator, instrumented
+from transitionMatrix.model import matrix_exponent
+from transitionMatrix.utils.exposure import state_exposure
+
+
+class TimeHomogeneousEstimator(DurationEstimator):
+
+    """
+    Class for implementing the time homogeneous (constant transition rates) duration estimator. This is the
+    maximum likelihood estimator of the transition matrix generator:
+
+    Q_ij = N_ij / R_i, Q_ii = - sum_j Q_ij
+
+    where N_ij is the number of observed transitions from state i to state j and R_i is the total time spent
+    (at risk) in state i. Transition matrices for any horizon t follow as T(t) = exp(t Q)
+
+    Documentation: `Transition Matrix Generator <https://www.openriskmanual.org/wiki/Transition_Matrix_Generator>`_
+
+    """
+
+    def __init__(self, states=None, binning=None):
+        DurationEstimator.__init__(self, binning=binning)
+        if states is not None:
+            self.states = states
+        self.generator = None
+        self.exposure = None
+        self.migration_count = None
+        self.segments = None
+        self._window = None
+
+    @instrumented
+    def fit(self, data, labels=None, end_time=None):
+        """
+        Parameters
+        ----------
+        data : dataframe - The data to use for the estimation in compact format (one row per observation) with the following columns (or pass a label object that will assign accordingly):
+
+            * ID: A unique entity identification number
+            * Time: Time of the observation
+            * State: The state of the entity at that time
+            * Segment: (optional, only if present in labels) A segment key. A generator is estimated per segment
+
+        labels: an optional dictionary for relabeling column names if those deviate from the convention
+        end_time: the end of the observation window (right censoring of the last state of each entity). The default is the latest observation time
+
+        Returns
+        -------
+        generator : the estimated generator. A two dimensional array (From State, To State), or a three dimensional array (Segment, From State, To State) if a segment label is given
+
+        Notes
+        ------
+
+        * exposure is computed with the vectorized exposure engine (transitionMatrix.utils.exposure)
+        * transitions and exposures of all segments are accumulated in a single pass with bincount
+        * memory use is linear in the number of events
+
+        """
+        with self._phase('ingestion', rows=len(data)):
+            event_arrays = self._event_arrays(data, labels)
+        return self._fit_events(event_arrays, end_time)
+
+    @instrumented
+    def fit_arrays(self, entity_id, event_time, entity_state, segment=None, end_time=None):
+        """
+        Estimate the generator from event arrays instead of a dataframe (e.g. columns held by a feature store).
+        Any array-like or buffer protocol object (memoryview, array.array) is accepted; contiguous numpy arrays
+        (float times, integer states) are used without copies. The result is identical to fit.
+
+        :param entity_id: array of entity identifiers
+        :param event_time: array of observation times
+        :param entity_state: array of observed states (state indexes or labels)
+        :param segment: (optional) array of segment keys, a generator is estimated per segment
+        :param end_time: the end of the observation window (see fit)
+
+        :returns: generator : the estimated generator
+        """
+        with self._phase('ingestion', rows=len(entity_id)):
+            event_arrays = self._encode_events(entity_id, event_time, entity_state, segment)
+        return self._fit_events(event_arrays, end_time)
+
+    def _fit_events(self, event_arrays, end_time=None):
+        with self._phase('counting', rows=len(event_arrays[0])):
+            self._prepare_shards(event_arrays, end_time=end_time)
+            counts = self._shard_counts(event_arrays)
+        with self._phase('normalization'):
+            return self._fit_shards(counts, event_arrays)
+
+    def _event_arrays(self, data, labels=None):
+        """
+        Extract the event data of a compact format dataframe into 1d arrays. Segment keys are encoded as integers
+        (and stored in the segments attribute). Rows with missing state or time are flagged as not existing.
+
+        """
+        if labels is not None:
+            state_label = labels['State']
+            timestep_label = labels['Time']
+            id_label = labels['ID']
+            segment_label = labels.get('Segment')
+        else:
+            state_label = 'State'
+            id_label = 'ID'
+            timestep_label = 'Time'
+            segment_label = None
+
+        segment = data[segment_label].to_numpy() if segment_label is not None else None
+        return self._encode_events(data[id_label].to_numpy(), data[timestep_label].to_numpy(),
+                                   data[state_label].to_numpy(), segment)
+
+    def _encode_events(self, entity_id, event_time, entity_state, segment=None):
+        """
+        Convert event arrays into the estimator representation: binned float times, encoded states, integer
+        segment codes and the existence flag of each event. Numeric inputs are not copied (unless binned).
+
+        """
+        entity_id = np.asarray(entity_id)
+        event_time = self.bin_times(event_time)
+        entity_state = self.states.encode(np.asarray(entity_state))
+        if segment is not None:
+            segment, self.segments = pd.factorize(np.asarray(segment), sort=True)
+        else:
+            segment = np.zeros(len(entity_id), dtype=int)
+            self.segments = None
+
+        # Capture nan events for potentially missing observations
+        event_exists = ~(np.isnan(entity_state) | np.isnan(event_time))
+
+        return entity_id, event_time, entity_state, segment, event_exists
+
+    def _prepare_shards(self, event_arrays, end_time=None):
+        """ The observation window is common to all shards """
+        event_time = event_arrays[1][event_arrays[4]]
+        if end_time is None:
+            end_time = event_time.max() if len(event_time) else 0.0
+        start_time = event_time.min() if len(event_time) else end_time
+        self._window = (start_time, end_time)
+
+    def _shard_counts(self, event_arrays):
+        """
+        Exposures and migration counts of a shard of entities
+
+        :returns: flattened vector of the exposures (Segment, State) followed by the migration counts (Segment, From State, To State)
+        """
+        entity_id, event_time, entity_state, segment, event_exists = event_arrays
+        state_dim = self.states.cardinality
+        segment_dim = 1 if self.segments is None else len(self.segments)
+        start_time, end_time = self._window
+
+        entity_id = entity_id[event_exists]
+        event_time = event_time[event_exists]
+        entity_state = entity_state[event_exists].astype(int)
+        segment = segment[event_exists]
+
+        # Ensure (ID, Time) ordering
+        if len(entity_id) > 1:
+            same_entity = entity_id[1:] == entity_id[:-1]
+            if not ((entity_id[1:] >= entity_id[:-1]).all() and (event_time[1:][same_entity] >= event_time[:-1][same_entity]).all()):
+                order = np.lexsort((event_time, entity_id))
+                entity_id = entity_id[order]
+                event_time = event_time[order]
+                entity_state = entity_state[order]
+                segment = segment[order]
+
+        # Time at risk: each observed state lasts until the next observation of the same entity,
+        # or until the end of the observation window for the last observation
+        # Segments are handled as a combined (segment, state) index
+        exposure = state_exposure(entity_id, event_time, segment * state_dim + entity_state, [start_time, end_time],
+                                  segment_dim * state_dim, end_time=end_time)
+
+        # Observed transitions between successive observations of the same entity
+        same_entity = np.zeros(len(entity_id), dtype=bool)
+        same_entity[:-1] = entity_id[1:] == entity_id[:-1]
+        migrated = np.flatnonzero(same_entity)
+        migrated = migrated[entity_state[migrated] != entity_state[migrated + 1]]
+        migration_cells = (segment[migrated] * state_dim + entity_state[migrated]) * state_dim \
+            + entity_state[migrated + 1]
+        migration_count = np.bincount(migration_cells, minlength=segment_dim * state_dim * state_dim)
+
+        return np.concatenate((exposure.ravel(), migration_count))
+
+    def _fit_shards(self, counts, event_arrays):
+        """ Estimate the generator from the (summed) exposures and migration counts """
+        state_dim = self.states.cardinality
+        segment_dim = 1 if self.segments is None else len(self.segments)
+        self.nans = int((~event_arrays[4]).sum())
+        self.counts = len(event_arrays[0])
+
+        exposure = counts[:segment_dim * state_dim].reshape((segment_dim, state_dim))
+        migration_count = counts[segment_dim * state_dim:].astype(int).reshape((segment_dim, state_dim, state_dim))
+
+        generator = np.zeros((segment_dim, state_dim, state_dim), dtype=float)
+        np.divide(migration_count, exposure[:, :, np.newaxis], out=generator,
+                  where=exposure[:, :, np.newaxis] > 0)
+        diagonal = np.arange(state_dim)
+        generator[:, diagonal, diagonal] = - generator.sum(axis=2)
+
+        if self.segments is None:
+            generator = generator[0]
+            exposure = exposure[0]
+            migration_count = migration_count[0]
+
+        self.generator = generator
+        self.exposure = exposure
+        self.migration_count = migration_count
+
+        return self.generator
+
+    def transition_matrix(self, t=1.0, segment=None):
+        """
+        Compute the transition matrix for a given horizon from the estimated generator
+
+        :param t: the time horizon
+        :param segment: the segment key (required if the estimation used segments)
+        :type t: float
+
+        :returns: TransitionMatrix
+        """
+        if self.segments is None:
+            generator = self.generator
+        else:
+            generator = self.generator[list(self.segments).index(segment)]
+        return matrix_exponent(generator, t)
@@ -0,0 +1,137 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" This module provides the sufficient statistics of transition matrix estimation
+
+* TransitionCounts_ holds migration and population count tensors that can be merged across data shards
+
+"""
+
+import json
+
+import numpy as np
+
+from transitionMatrix.utils.confidence import multinomial_confint
+
+
+class TransitionCounts(object):
+    """ The _`TransitionCounts` object holds the counts from which transition matrices are estimated:
+
+    * migrations: the number of transitions N^{ij}_k from state i to state j in period k, array of shape (S, S, K)
+    * population: the number of entities N^i_k in state i at the start of period k, array of shape (S, K) or (S, K + 1) (the last column then holds the population at the end of the last period)
+
+    Counts are additive: counts of different shards of a dataset (entity partitions, or data processed on different
+    machines or days) can be merged with + without revisiting the raw events.
+
+    """
+
+    def __init__(self, migrations=None, population=None, json_file=None):
+        """ Create a new set of transition counts, either from count arrays or from a json file
+
+        :param migrations: array-like (S, S, K) of migration counts
+        :param population: array-like (S, K) or (S, K + 1) of population counts
+        :param json_file: a json file containing transition counts (see to_json)
+
+        """
+        if json_file is not None:
+            with open(json_file, 'r') as f:
+                q = json.load(f)
+            migrations = q['migrations']
+            population = q['population']
+        self.migrations = np.asarray(migrations)
+        self.population = np.asarray(population)
+        if self.migrations.ndim != 3 or self.population.ndim != 2:
+            raise ValueError('Migration counts must be three dimensional and population counts two dimensional')
+        if self.population.shape[1] not in (self.periods, self.periods + 1):
+            raise ValueError('Population counts do not match the periods of migration counts')
+
+    @property
+    def states(self):
+        """ The number of states S """
+        return self.migrations.shape[0]
+
+    @property
+    def periods(self):
+        """ The number of periods K """
+        return self.migrations.shape[2]
+
+    def __add__(self, other):
+        if other == 0:
+            return self
+        if self.migrations.shape != other.migrations.shape or self.population.shape != other.population.shape:
+            raise ValueError('Cannot merge transition counts of different shapes')
+        return TransitionCounts(self.migrations + other.migrations, self.population + other.population)
+
+    # allow sum() over a collection of counts
+    __radd__ = __add__
+
+    def __eq__(self, other):
+        if not isinstance(other, TransitionCounts):
+            return NotImplemented
+        return np.array_equal(self.migrations, other.migrations) and np.array_equal(self.population,
+                                                                                    other.population)
+
+    def __getitem__(self, period):
+        """ Select a period (integer) or a contiguous range of periods (slice) """
+        if isinstance(period, slice):
+            start, stop, step = period.indices(self.periods)
+            if step != 1:
+                raise ValueError('Only contiguous period ranges can be selected')
+        else:
+            start = range(self.periods)[period]
+            stop = start + 1
+        extra = self.population.shape[1] - self.periods
+        return TransitionCounts(self.migrations[:, :, start:stop], self.population[:, start:stop + extra])
+
+    def matrices(self):
+        """ Transition probabilities per period, T^{ij}_k = N^{ij}_k / N^i_k (zero for unpopulated states)
+
+        :returns: array of shape (S, S, K)
+        """
+        values = np.zeros(self.migrations.shape, dtype=float)
+        normalization = self.population[:, np.newaxis, :self.periods]
+        np.divide(self.migrations, normalization, out=values, where=normalization > 0)
+        return values
+
+    def average(self):
+        """ Count averaged transition matrix over all periods (assuming temporal homogeneity)
+
+        :returns: array of shape (S, S)
+        """
+        total = self.population[:, :self.periods].sum(axis=1)
+        values = np.zeros((self.states, self.states), dtype=float)
+        np.divide(self.migrations.sum(axis=2), total[:, np.newaxis], out=values, where=total[:, np.newaxis] > 0)
+        return values
+
+    def confint(self, method='goodman', alpha=0.05):
+        """ Confidence intervals of the transition probabilities, based on the multinomial migration counts of each
+        state and period
+
+        :param method: the confidence interval method (see transitionMatrix.utils.confidence.multinomial_confint)
+        :param alpha: significance level
+        :returns: confint_lower, confint_upper arrays of shape (S, S, K)
+        """
+        return multinomial_confint(self.migrations, alpha=alpha, method=method, axis=1)
+
+    def to_json(self, file=None):
+        """
+        Write transition counts to file in json format
+
+        :param file: json filename (if None a json string is returned)
+        """
+        q = {'migrations': self.migrations.tolist(), 'population': self.population.tolist()}
+        if file is None:
+            return json.dumps(q)
+        with open(file, 'w') as f:
+            json.dump(q, f)
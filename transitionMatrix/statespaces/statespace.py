@@ -17,6 +17,14 @@
 
 """
 
+import numpy as np
+import pandas as pd
+
+from transitionMatrix.utils.preprocessing import absorbed_observations, absorbing_violations, stale_observations
+
+# string representations of missing state values
+MISSING_STATES = ['', 'n', 'nan', 'NaN', 'None']
+
 
 class StateSpace(object):
     """  The StateSpace object stores a state space structure as a List of tuples
@@ -30,7 +38,8 @@ class StateSpace(object):
 
     .. Todo:: Implement Absorbing States
 
-    .. Todo:: Implement in estimators
+    State values in datasets may be given either as state indexes or as state labels, the estimators encode them
+    into integer indexes with the encode method
 
     """
 
@@ -67,6 +76,7 @@ class StateSpace(object):
         self.originator = originator
         self.full_name = full_name
         self.cqs_mapping = cqs_mapping
+        self._encoding = None
 
     def _infer(self, transition_data):
         """ Infer the state space from the data. This uses the State column by default and does an automated sorting by default.
@@ -103,6 +113,76 @@ class StateSpace(object):
             states.append(state[1])
         return states
 
+    def _state_encoding(self):
+        """ The mapping of state indexes and labels to integer indexes (cached per definition)
+
+        """
+        definition = tuple((str(state[0]), str(state[1])) for state in getattr(self, 'definition', []))
+        if getattr(self, '_encoding', None) is None or self._encoding[0] != definition:
+            mapping = {}
+            for i, (index, label) in enumerate(definition):
+                mapping[label] = i
+            # state indexes take precedence over (conflicting) labels
+            for i, (index, label) in enumerate(definition):
+                mapping[index] = i
+            self._encoding = (definition, mapping)
+        return self._encoding[1]
+
+    @staticmethod
+    def _encoding_key(value):
+        if isinstance(value, (float, np.floating)) and float(value).is_integer():
+            return str(int(value))
+        return str(value)
+
+    def encode(self, values):
+        """ Encode a column of state values (state indexes or state labels, e.g. 'AAA') into integer state indexes.
+        The mapping is applied once per distinct value.
+
+        :param values: array-like of state values
+        :returns: float array of state indexes (nan for missing values, see MISSING_STATES)
+        :raises ValueError: listing all values that are not part of the state space
+
+        """
+        values = pd.Series(values)
+        if pd.api.types.is_integer_dtype(values) and len(values) and values.min() >= 0 \
+                and values.max() < self.cardinality \
+                and [str(s) for s in self.get_states()] == [str(i) for i in range(self.cardinality)]:
+            # fast path for already encoded data
+            return values.to_numpy(dtype=float)
+        codes, uniques = pd.factorize(values)
+        mapping = self._state_encoding()
+        unique_index = np.array([mapping.get(self._encoding_key(u), -1) for u in uniques], dtype=float)
+        # string representations of missing values (e.g. 'n' in bin_timestamps output) are missing as well
+        unique_index[[i < 0 and str(u) in MISSING_STATES for u, i in zip(uniques, unique_index)]] = np.nan
+        unknown = [u for u, i in zip(uniques, unique_index) if i < 0]
+        if unknown:
+            raise ValueError('Dataset contains states that are not part of the state space: ' + str(unknown))
+        encoded = np.full(len(codes), np.nan)
+        valid = codes >= 0
+        encoded[valid] = unique_index[codes[valid]]
+        return encoded
+
+    def encode_dataset(self, dataset, labels=None):
+        """ Encode the state columns of a dataset once, so that repeated estimations use integer states directly
+
+        :param dataset: the dataset (pandas dataframe)
+        :param labels: an optional dictionary for relabeling column names. The State, From and To columns are encoded (if present)
+        :returns: a copy of the dataset with encoded state columns
+
+        """
+        if labels is None:
+            labels = {}
+        encoded = dataset.copy()
+        for key in ['State', 'From', 'To']:
+            column = labels.get(key, key)
+            if column in encoded.columns:
+                states = self.encode(encoded[column])
+                if np.isnan(states).any():
+                    encoded[column] = states
+                else:
+                    encoded[column] = states.astype(int)
+        return encoded
+
     def generic(self, n=2):
         """ Create a generic state space of size n
 
@@ -118,10 +198,10 @@ class StateSpace(object):
 
         1: all the states in dataset exist in the state space description (error otherwise)
         2: all the states in state space exist in dataset (warning otherwise)
-        3: TODO successive states for the same entity are different, unless the Sticky flag is True
+        3: successive states for the same entity are different, unless the Sticky flag is True (warning with the compression ratio otherwise, see compress_stale_observations)
 
-        :param dataset: the dataset to test
-        :param labels: the labels of the state space
+        :param dataset: the dataset to test (sorted by ID and Time for test 3)
+        :param labels: the labels of the state space (State and ID columns)
 
         :returns: a list of validation messages
 
@@ -160,8 +240,40 @@ class StateSpace(object):
             validation_outcome = ''
             validation_message = "Dataset contains the expected states."
 
+        # Repeated observations of unchanged states are only expected for sticky state spaces
+        id_label = labels.get('ID', 'ID') if labels is not None else 'ID'
+        if not self.sticky and id_label in dataset.columns:
+            stale = stale_observations(dataset[id_label].to_numpy(), dataset[state_label].to_numpy())
+            if stale.any():
+                validation_message += " Dataset contains {0} repeated observations of unchanged states " \
+                                      "(compression ratio {1:.2f}).".format(stale.sum(), len(stale) / (~stale).sum())
+
         return validation_message, validation_outcome
 
+    def validate_absorbing(self, dataset, labels=None, truncate=False):
+        """ Check that the absorbing states of the state space have no transitions to another state in a dataset.
+        All absorbing states are checked in one pass
+
+        :param dataset: the dataset to test (in compact format, sorted by ID and Time)
+        :param labels: an optional dictionary for relabeling column names (ID, State)
+        :param truncate: also return a cleaned dataset, without the observations of each entity that follow a transition out of an absorbing state
+
+        :returns: the entity_id, from_state, to_state arrays of the offending transitions (and the cleaned dataset if truncate is True)
+
+        """
+        if labels is None:
+            labels = {}
+        entity_id = dataset[labels.get('ID', 'ID')].to_numpy()
+        entity_state = dataset[labels.get('State', 'State')].to_numpy()
+        # compare encoded states (the data and the absorbing states may use state indexes or labels)
+        encoded_state = self.encode(entity_state)
+        absorbing = self.encode(self.absorbing) if self.absorbing else []
+        violation = absorbing_violations(entity_id, encoded_state, absorbing)
+        violations = (entity_id[violation], entity_state[violation], entity_state[violation + 1])
+        if truncate:
+            return violations, dataset[~absorbed_observations(entity_id, encoded_state, absorbing)]
+        return violations
+
     def describe(self):
         """
         Print the State Space description
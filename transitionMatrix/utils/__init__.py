@@ -21,6 +21,9 @@ from __future__ import print_function, division
 
 from .preprocessing import *
 from .converters import *
+from .exposure import *
+from .confidence import *
+from .profiling import *
 
 
 def print_matrix(A, format_type='Standard', accuracy=2):
@@ -0,0 +1,95 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Confidence intervals of transition probabilities computed from count arrays
+
+"""
+
+from __future__ import print_function, division
+
+from functools import lru_cache
+
+import numpy as np
+import statsmodels.stats.proportion as st
+from scipy import stats
+
+CONFINT_METHODS = ['goodman', 'wilson', 'binomial', 'sison-glaz']
+
+
+def multinomial_confint(counts, alpha=0.05, method='goodman', axis=1):
+    """
+    Confidence intervals for multinomial proportions, computed for all rows of a count array at once
+    (e.g. the (From State, To State, Period) migration counts of an estimator)
+
+    :param counts: array of counts, the categories (e.g. To State) are along the given axis
+    :param alpha: significance level
+    :param method: the confidence interval method
+
+        * goodman: simultaneous intervals based on a chi-squared approximation (same as statsmodels)
+        * wilson: Wilson score interval of each proportion
+        * binomial: normal approximation (Wald) interval of each proportion, truncated to [0, 1]
+        * sison-glaz: simultaneous intervals of Sison and Glaz (computed row by row with statsmodels, results are cached)
+
+    :param axis: the axis of the categories
+    :type alpha: float
+    :type method: str
+    :type axis: int
+
+    :returns: confint_lower, confint_upper arrays of the same shape as counts
+
+    .. note:: Rows without any counts have undefined (nan) intervals
+
+    """
+    if alpha <= 0 or alpha >= 1:
+        raise ValueError("alpha must be in (0, 1), bounds excluded")
+    if method not in CONFINT_METHODS:
+        raise NotImplementedError("Method " + str(method) + " is not implemented")
+    counts = np.moveaxis(np.asarray(counts, dtype=float), axis, -1)
+    if (counts < 0).any():
+        raise ValueError("counts must be >= 0")
+
+    if method == 'sison-glaz':
+        rows = counts.reshape((-1, counts.shape[-1]))
+        intervals = np.array([_sison_glaz(tuple(row), alpha) for row in rows]).reshape(counts.shape + (2,))
+        return np.moveaxis(intervals[..., 0], -1, axis), np.moveaxis(intervals[..., 1], -1, axis)
+
+    n = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proportions = counts / n
+        if method == 'goodman':
+            chi2 = stats.chi2.ppf(1 - alpha / counts.shape[-1], 1)
+            delta = np.sqrt(chi2 ** 2 + 4 * n * proportions * chi2 * (1 - proportions))
+            lower = (2 * n * proportions + chi2 - delta) / (2 * (chi2 + n))
+            upper = (2 * n * proportions + chi2 + delta) / (2 * (chi2 + n))
+        elif method == 'wilson':
+            z = stats.norm.ppf(1 - alpha / 2)
+            center = (proportions + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+            halfwidth = z / (1 + z ** 2 / n) * np.sqrt(proportions * (1 - proportions) / n + z ** 2 / (4 * n ** 2))
+            lower = center - halfwidth
+            upper = center + halfwidth
+        else:
+            z = stats.norm.ppf(1 - alpha / 2)
+            halfwidth = z * np.sqrt(proportions * (1 - proportions) / n)
+            lower = np.clip(proportions - halfwidth, 0, 1)
+            upper = np.clip(proportions + halfwidth, 0, 1)
+
+    return np.moveaxis(lower, -1, axis), np.moveaxis(upper, -1, axis)
+
+
+@lru_cache(maxsize=4096)
+def _sison_glaz(counts, alpha):
+    """ Sison-Glaz intervals of a single row of counts (cached, as the computation is iterative) """
+    if sum(counts) == 0:
+        return np.full((len(counts), 2), np.nan)
+    return st.multinomial_proportions_confint(counts, alpha=alpha, method='sison-glaz')
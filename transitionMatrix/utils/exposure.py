@@ -0,0 +1,145 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Exposure (time at risk) computations on compact format (ID, Time, State) data
+
+"""
+
+from __future__ import print_function, division
+
+import numpy as np
+
+
+def entity_chunks(entity_id, chunk_size):
+    """
+    Split sorted event data into slices that contain at most chunk_size entities (entity histories are never split)
+
+    :param entity_id: array of entity identifiers (sorted / grouped by entity)
+    :param chunk_size: the maximum number of entities per slice
+    :type chunk_size: int
+
+    :returns: generator of slice objects
+    """
+    entity_id = np.asarray(entity_id)
+    if len(entity_id) == 0:
+        return
+    entity_start = np.flatnonzero(np.r_[True, entity_id[1:] != entity_id[:-1]])
+    for c in range(0, len(entity_start), chunk_size):
+        start = entity_start[c]
+        stop = entity_start[c + chunk_size] if c + chunk_size < len(entity_start) else len(entity_id)
+        yield slice(start, stop)
+
+
+def state_spells(entity_id, event_time, entity_state, end_time=None):
+    """
+    Convert sorted observations into spells: each observed state lasts until the next observation of the same
+    entity, or until end_time for the last observation of an entity
+
+    :param entity_id: array of entity identifiers
+    :param event_time: array of observation times
+    :param entity_state: array of (integer) states
+    :param end_time: the end of the observation window (default is the latest observation time)
+
+    :returns: spell_start, spell_end, spell_state arrays
+
+    .. warning:: The data must be sorted by (ID, Time) already
+    """
+    entity_id = np.asarray(entity_id)
+    event_time = np.asarray(event_time, dtype=float)
+    if end_time is None:
+        end_time = event_time.max() if len(event_time) else 0.0
+    spell_end = np.full(len(event_time), end_time, dtype=float)
+    same_entity = entity_id[1:] == entity_id[:-1]
+    spell_end[:-1][same_entity] = event_time[1:][same_entity]
+    return event_time, spell_end, np.asarray(entity_state)
+
+
+def state_exposure(entity_id, event_time, entity_state, interval_bounds, state_dim, end_time=None, chunk_size=None):
+    """
+    Compute the time at risk spent in each state within each interval
+
+    :param entity_id: array of entity identifiers
+    :param event_time: array of observation times
+    :param entity_state: array of integer states (in range(state_dim))
+    :param interval_bounds: the K + 1 sorted boundaries of K intervals
+    :param state_dim: the number of states
+    :param end_time: the end of the observation window (default is the latest observation time)
+    :param chunk_size: optional maximum number of entities processed at a time (bounds the temporary memory use)
+    :type state_dim: int
+    :type chunk_size: int
+
+    :returns: (S, K) numpy array of exposures
+
+    .. note:: Exposures are additive over entities, hence the results of separate chunks of a dataset can be summed
+
+    .. warning:: The data must be sorted by (ID, Time) already
+
+    """
+    entity_id = np.asarray(entity_id)
+    event_time = np.asarray(event_time, dtype=float)
+    entity_state = np.asarray(entity_state)
+    if end_time is None:
+        end_time = event_time.max() if len(event_time) else 0.0
+    if chunk_size is not None:
+        exposure = np.zeros((state_dim, len(interval_bounds) - 1), dtype=float)
+        for chunk in entity_chunks(entity_id, chunk_size):
+            exposure += state_exposure(entity_id[chunk], event_time[chunk], entity_state[chunk], interval_bounds,
+                                       state_dim, end_time=end_time)
+        return exposure
+
+    spell_start, spell_end, spell_state = state_spells(entity_id, event_time, entity_state, end_time=end_time)
+    return spell_exposure(spell_start, spell_end, spell_state, interval_bounds, state_dim)
+
+
+def spell_exposure(spell_start, spell_end, spell_state, interval_bounds, state_dim):
+    """
+    Accumulate the duration of spells [start, end) in state per interval
+
+    * spells are clipped to the range of the interval bounds
+    * the first and last interval of a spell receive the partial overlap
+    * intervals fully covered by a spell are accumulated with a difference array
+
+    :returns: (S, K) numpy array of exposures
+    """
+    bounds = np.asarray(interval_bounds, dtype=float)
+    interval_dim = len(bounds) - 1
+    widths = np.diff(bounds)
+
+    a = np.clip(spell_start, bounds[0], bounds[-1])
+    b = np.clip(spell_end, bounds[0], bounds[-1])
+    keep = b > a
+    a = a[keep]
+    b = b[keep]
+    s = np.asarray(spell_state)[keep].astype(int)
+
+    # interval containing the start (left closed) and the end (right closed) of each spell
+    ka = np.clip(np.searchsorted(bounds, a, side='right') - 1, 0, interval_dim - 1)
+    kb = np.clip(np.searchsorted(bounds, b, side='left') - 1, 0, interval_dim - 1)
+
+    cell_count = state_dim * interval_dim
+    single = ka == kb
+    exposure = np.zeros(cell_count, dtype=float)
+    exposure += np.bincount(s[single] * interval_dim + ka[single], weights=(b - a)[single], minlength=cell_count)
+
+    multi = ~single
+    s, a, b, ka, kb = s[multi], a[multi], b[multi], ka[multi], kb[multi]
+    exposure += np.bincount(s * interval_dim + ka, weights=bounds[ka + 1] - a, minlength=cell_count)
+    exposure += np.bincount(s * interval_dim + kb, weights=b - bounds[kb], minlength=cell_count)
+
+    # full intervals ka + 1, ..., kb - 1
+    coverage = np.bincount(s * (interval_dim + 1) + ka + 1, minlength=state_dim * (interval_dim + 1)) \
+        - np.bincount(s * (interval_dim + 1) + kb, minlength=state_dim * (interval_dim + 1))
+    coverage = np.cumsum(coverage.reshape((state_dim, interval_dim + 1)), axis=1)[:, :interval_dim]
+
+    return exposure.reshape((state_dim, interval_dim)) + coverage * widths
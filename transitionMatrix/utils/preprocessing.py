@@ -19,57 +19,112 @@ module transitionMatrix.utils - helper classes and functions
 
 from __future__ import print_function, division
 
+import itertools
+
 import numpy as np
 import pandas as pd
 import pprint as pp
-from transitionMatrix.utils.converters import frame_to_array
+
+from transitionMatrix.utils.profiling import dataset_profile
+
+# the built-in reducers of the events in a cohort interval (see EventIndex.reduce)
+REDUCERS = ['first', 'last', 'count', 'worst', 'most_frequent', 'time_weighted']
 
 
 def validate_absorbing_state(dataframe, state):
-    """ Validate whether a given state is actually absorbing (there should be no transitions to another state)
+    """ Validate whether a given state (or list of states) is actually absorbing (there should be no transitions to
+    another state)
 
-    :param dataframe: an input data frame
-    :param state: the state to validate
+    :param dataframe: an input data frame (sorted by ID and Time)
+    :param state: the state (or list of states) to validate
     :type state: int
 
     :return: a list of exceptions
     """
 
-    exceptions = []
-    entity_id, event_time, entity_state = frame_to_array(dataframe)
-    for i in range(len(entity_id) - 1):
-        if entity_id[i + 1] == entity_id[i] and entity_state[i] == state and entity_state[i + 1] != state:
-            exceptions.append((entity_id[i], entity_state[i], entity_state[i + 1]))
-    return exceptions
+    entity_id = dataframe['ID'].to_numpy()
+    entity_state = dataframe['State'].to_numpy()
+    violation = absorbing_violations(entity_id, entity_state, np.atleast_1d(state))
+    return list(zip(entity_id[violation], entity_state[violation], entity_state[violation + 1]))
 
 
-def transitions_summary(dataframe):
-    """
-    Calculate some summary statistics about transitions
-    :param dataframe: input dataframe
-    :return: dict
+def absorbing_violations(entity_id, entity_state, absorbing):
+    """ Find the transitions out of absorbing states. All absorbing states are checked in one pass over successive
+    observations of the same entity (missing observations are not transitions)
+
+    :param entity_id: array of entity identifiers (sorted by ID and Time)
+    :param entity_state: array of observed states
+    :param absorbing: list of absorbing states
+
+    :return: the positions i of the offending transitions (from observation i to observation i + 1)
     """
-    statistics = {}
-    try:
-        statistics['unique_entities'] = len(list(unique_entities(dataframe)))
-    except Exception as e:
-        statistics['unique_entities'] = 'Could not parse entities'
+    entity_id = np.asarray(entity_id)
+    entity_state = np.asarray(entity_state)
+    return np.flatnonzero((entity_id[1:] == entity_id[:-1]) & np.isin(entity_state[:-1], absorbing)
+                          & (entity_state[1:] != entity_state[:-1]) & pd.notna(entity_state[1:]))
 
-    try:
-        statistics['unique_states'] = len(list(unique_states(dataframe)))
-    except Exception as e:
-        statistics['unique_states'] = 'Could not parse states'
 
-    try:
-        statistics['unique_timestamps'] = len(list(unique_timestamps(dataframe)))
-    except:
-        statistics['unique_timestamps'] = 'Could not parse timestamps'
+def absorbed_observations(entity_id, entity_state, absorbing):
+    """ Flag the observations that follow a transition out of an absorbing state: after its first absorbing state,
+    the observations of an entity are flagged from the first different (non missing) state onwards
+
+    :param entity_id: array of entity identifiers (sorted by ID and Time)
+    :param entity_state: array of observed states
+    :param absorbing: list of absorbing states
+
+    :return: boolean array
+    """
+    entity_id = np.asarray(entity_id)
+    entity_state = np.asarray(entity_state)
+    event_count = len(entity_id)
+    if event_count == 0:
+        return np.zeros(0, dtype=bool)
+    start = np.ones(event_count, dtype=bool)
+    start[1:] = entity_id[1:] != entity_id[:-1]
+    entity = np.cumsum(start) - 1
+    entity_start = np.flatnonzero(start)
+
+    # the first absorbing observation of each entity (event_count if never absorbed)
+    absorbed = np.flatnonzero(np.isin(entity_state, absorbing))
+    first_absorbed = np.full(len(entity_start), event_count)
+    np.minimum.at(first_absorbed, entity[absorbed], absorbed)
+    first_absorbed = first_absorbed[entity]
+    changed = (np.arange(event_count) > first_absorbed) & pd.notna(entity_state) \
+        & (entity_state != entity_state[np.minimum(first_absorbed, event_count - 1)])
+
+    # all observations from the first change of state onwards (within the entity)
+    changes = np.cumsum(changed)
+    return (changes - (changes - changed)[entity_start][entity]) > 0
+
+
+def truncate_absorbed(data, absorbing, labels=None):
+    """ Truncate the observations of each entity that follow a transition out of an absorbing state (see
+    absorbed_observations)
+
+    :param data: the dataframe to clean (sorted by ID and Time)
+    :param absorbing: list of absorbing states
+    :param labels: an optional dictionary for relabeling column names (ID, State)
+
+    :return: the cleaned dataframe
+    """
+    if labels is None:
+        labels = {}
+    flagged = absorbed_observations(data[labels.get('ID', 'ID')].to_numpy(),
+                                    data[labels.get('State', 'State')].to_numpy(), absorbing)
+    return data[~flagged]
 
-    try:
-        statistics['total_timestamps'] = total_timestamps(dataframe)
-    except:
-        statistics['total_timestamps'] = 'Could not parse timestamps'
 
+def transitions_summary(dataframe):
+    """
+    Calculate some summary statistics about transitions (see dataset_profile for the complete profile)
+    :param dataframe: input dataframe
+    :return: dict
+    """
+    profile = dataset_profile(dataframe)
+    statistics = {'unique_entities': profile.get('unique_entities', 'Could not parse entities'),
+                  'unique_states': profile.get('unique_states', 'Could not parse states'),
+                  'unique_timestamps': profile.get('unique_timestamps', 'Could not parse timestamps'),
+                  'total_timestamps': profile.get('total_timestamps', 'Could not parse timestamps')}
     return statistics
 
 
@@ -128,6 +183,53 @@ def unique_timestamps(data):
     return unique_timestamps
 
 
+def bin_event_times(event_times, resolution=None, tolerance=None, origin=None):
+    """
+    Bin (merge) close observation times so that they map to a common timepoint. Two binning modes are available:
+
+    * resolution: times are floored onto a regular grid of the given resolution starting at origin (e.g. 1/365 for daily binning of year-fraction times)
+    * tolerance: successive distinct times that are less than tolerance apart are merged into the earliest time of the group
+
+    :param event_times: array-like of observation times (float format)
+    :param resolution: the width of the regular time grid
+    :param tolerance: the maximum gap between successive times that are merged
+    :param origin: the origin of the regular time grid (default is the earliest observation time)
+    :type resolution: float
+    :type tolerance: float
+    :type origin: float
+
+    :returns: the binned times (numpy array, same order as the input) and the maximum absolute time shift introduced by binning
+
+    .. note:: The binning is monotonic, hence data sorted by time remain sorted after binning
+
+    """
+    event_times = np.asarray(event_times, dtype=float)
+    if event_times.size == 0:
+        return event_times.copy(), 0.0
+
+    if resolution is not None:
+        if not resolution > 0:
+            raise ValueError('Binning resolution must be positive')
+        if origin is None:
+            origin = event_times.min()
+        binned_times = origin + np.floor((event_times - origin) / resolution) * resolution
+    elif tolerance is not None:
+        if tolerance < 0:
+            raise ValueError('Binning tolerance must be non-negative')
+        unique_times, inverse = np.unique(event_times, return_inverse=True)
+        # A new bin starts wherever the gap to the previous distinct time exceeds the tolerance
+        new_bin = np.empty(len(unique_times), dtype=bool)
+        new_bin[0] = True
+        new_bin[1:] = np.diff(unique_times) > tolerance
+        bin_times = unique_times[new_bin]
+        binned_times = bin_times[np.cumsum(new_bin) - 1][inverse.reshape(-1)]
+    else:
+        binned_times = event_times.copy()
+
+    binning_error = float(np.abs(event_times - binned_times).max())
+    return binned_times, binning_error
+
+
 def generate_cohort_bounds(data, cohorts):
     """Generate cohort intervals given an input transition dataframe and the desired number of cohorts. The function finds the range of timestamps and divides it equally
 
@@ -153,9 +255,193 @@ def generate_cohort_bounds(data, cohorts):
     return dt, cohort_bounds
 
 
+class EventIndex(object):
+    """
+    Compact (CSR style) index of the events of each (entity, cohort interval) pair. The events are stored in flat
+    arrays grouped by pair, the events of pair g are the slice offsets[g]:offsets[g + 1] of the times and states
+    arrays (in the original order of the events).
+
+    This is the array equivalent of the event dictionary (see generate_event_dict) at a fraction of its memory. The
+    state assignment per cohort interval is applied to all pairs at once with a reducer (see reduce).
+
+    * entity_ids: the distinct entity identifiers (in order of appearance)
+    * entity: the entity index of each pair
+    * cohort: the cohort interval of each pair
+    * offsets: the start of the events of each pair (and the total number of events)
+    * times, states: the event times and states
+    * cohort_bounds: the boundaries of the cohort intervals (optional, required by the time weighted reducer)
+
+    """
+
+    def __init__(self, entity_ids, entity, cohort, offsets, times, states, cohort_bounds=None):
+        self.entity_ids = entity_ids
+        self.entity = entity
+        self.cohort = cohort
+        self.offsets = offsets
+        self.times = times
+        self.states = states
+        self.cohort_bounds = cohort_bounds
+
+    def __len__(self):
+        return len(self.entity)
+
+    def __getitem__(self, event_key):
+        """ The list of (time, state) events of an (entity_id, cohort interval) pair (as in the event dictionary) """
+        entity_id, cohort = event_key
+        entity_index = pd.Index(self.entity_ids).get_indexer([entity_id])[0]
+        g = np.flatnonzero((self.entity == entity_index) & (self.cohort == cohort))
+        if entity_index < 0 or len(g) == 0:
+            raise KeyError(event_key)
+        start, stop = self.offsets[g[0]], self.offsets[g[0] + 1]
+        return list(zip(self.times[start:stop].tolist(), self.states[start:stop].tolist()))
+
+    @property
+    def nbytes(self):
+        """ The memory used by the index arrays """
+        return sum(a.nbytes for a in [self.entity, self.cohort, self.offsets, self.times, self.states])
+
+    def counts(self):
+        """ The number of events of each pair """
+        return np.diff(self.offsets)
+
+    def reduce(self, reducer='last', values='states', order=None):
+        """
+        Reduce the events of each pair to a single value (e.g. the state assigned to the cohort interval). All pairs
+        are reduced at once over the grouped event arrays. The available reducers are:
+
+        * 'last' / 'first': the last (first) observation in the interval
+        * 'count': the number of observations in the interval
+        * 'worst': the worst observed state (the highest state, or the latest state in the given order)
+        * 'most_frequent': the most frequently observed state (ties are resolved in favour of the latest observation)
+        * 'time_weighted': the state held for the longest time within the interval (each observed state is held until the next observation or the end of the interval)
+        * a numpy ufunc (e.g. np.maximum, np.add), applied with reduceat
+        * a function f(values, offsets) returning the reduced value of each pair
+
+        :param reducer: the reducer (see REDUCERS)
+        :param values: the event values to reduce ('states' or 'times')
+        :param order: the states ordered from best to worst (for the 'worst' reducer with non numeric states)
+        :returns: array with the reduced value of each pair
+        """
+        values = self.states if values == 'states' else self.times
+        starts = self.offsets[:-1]
+        if reducer == 'last':
+            return values[self.offsets[1:] - 1]
+        elif reducer == 'first':
+            return values[starts]
+        elif reducer == 'count':
+            return self.counts()
+        elif len(self) == 0:
+            return values[:0]
+        elif reducer == 'worst':
+            if order is None:
+                return np.fmax.reduceat(values, starts)
+            rank = pd.Series(np.arange(len(order)), index=order).reindex(values).to_numpy()
+            worst = np.fmax.reduceat(rank, starts)
+            reduced = np.empty(len(self), dtype=object)
+            reduced[:] = np.nan
+            ranked = ~np.isnan(worst)
+            reduced[ranked] = np.asarray(order, dtype=object)[worst[ranked].astype(int)]
+            return reduced
+        elif reducer == 'most_frequent':
+            return self._weighted_mode(values, np.ones(len(values)))
+        elif reducer == 'time_weighted':
+            if self.cohort_bounds is None:
+                raise ValueError('The time weighted reducer requires the cohort bounds of the index')
+            # each observed state is held until the next observation in the interval, or the end of the interval
+            bounds = np.asarray(self.cohort_bounds, dtype=float)
+            last = self.offsets[1:] - 1
+            interval_end = np.where(self.cohort < len(bounds), bounds[np.minimum(self.cohort, len(bounds) - 1)],
+                                    self.times[last])
+            next_time = np.empty(len(self.times))
+            next_time[:-1] = self.times[1:]
+            next_time[last] = interval_end
+            return self._weighted_mode(values, next_time - self.times)
+        elif isinstance(reducer, np.ufunc):
+            return reducer.reduceat(values, starts)
+        elif callable(reducer):
+            return reducer(values, self.offsets)
+        raise NotImplementedError("Reducer " + str(reducer) + " is not implemented")
+
+    def _weighted_mode(self, values, weights):
+        """ The value with the largest total weight in each pair (ties are resolved by the latest observation) """
+        pair = np.repeat(np.arange(len(self)), self.counts())
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        key = pair * len(uniques) + codes
+        keys, key_index = np.unique(key, return_inverse=True)
+        key_index = key_index.reshape(-1)
+        total = np.bincount(key_index, weights=weights)
+        latest = np.zeros(len(keys), dtype=int)
+        np.maximum.at(latest, key_index, np.arange(len(values)))
+        # the best value of each pair is ranked last
+        ranking = np.lexsort((latest, total, keys // len(uniques)))
+        best = ranking[np.r_[keys[ranking][1:] // len(uniques) != keys[ranking][:-1] // len(uniques), True]]
+        return values[latest[best]]
+
+    def remove_stale(self):
+        """
+        Remove events followed by an event with the same state within the same pair (see remove_stale_events)
+
+        :returns: a new EventIndex
+        """
+        last = np.zeros(len(self.states), dtype=bool)
+        last[self.offsets[1:] - 1] = True
+        keep = last.copy()
+        keep[:-1] |= self.states[1:] != self.states[:-1]
+        offsets = np.concatenate(([0], np.cumsum(keep)))[self.offsets]
+        return EventIndex(self.entity_ids, self.entity, self.cohort, offsets, self.times[keep], self.states[keep],
+                          self.cohort_bounds)
+
+    def to_dict(self):
+        """ Convert the index into an event dictionary (see generate_event_dict) """
+        entity_ids = np.asarray(self.entity_ids)[self.entity].tolist()
+        events = list(zip(self.times.tolist(), self.states.tolist()))
+        offsets = self.offsets.tolist()
+        return {(entity_id, cohort): events[offsets[g]:offsets[g + 1]]
+                for g, (entity_id, cohort) in enumerate(zip(entity_ids, self.cohort.tolist()))}
+
+
+def generate_event_index(data, cohort_bounds):
+    """
+    Assign all events to cohort intervals and construct an EventIndex of the events of each (entity, cohort
+    interval) pair. The assignment is identical to generate_event_dict:
+
+    * events at the initial time are initial state observations (cohort interval 0), only the last one is retained
+    * an event in the interval (b_{c-1}, b_c] belongs to cohort interval c
+
+    :param data: a pandas dataframe (with ID, Time and State columns)
+    :param cohort_bounds: the boundaries of the cohort intervals
+    :return: EventIndex
+
+    """
+    cohort_dim = len(cohort_bounds) + 1
+    entity_index, entity_ids = pd.factorize(data['ID'])
+    event_time = data['Time'].to_numpy(dtype=float)
+    event_state = data['State'].to_numpy()
+
+    # Find the interval of each event (the cohort it belongs to)
+    event_cohort = np.searchsorted(np.asarray(cohort_bounds, dtype=float), event_time, side='left')
+    event_cohort[np.isnan(event_time)] = 1
+
+    # Group the events of each pair, preserving their order
+    key = entity_index.astype(np.int64) * cohort_dim + event_cohort
+    order = np.flatnonzero(entity_index >= 0)
+    order = order[np.argsort(key[order], kind='stable')]
+    key = key[order]
+    last = np.ones(len(key), dtype=bool)
+    last[:-1] = key[1:] != key[:-1]
+    # ATTN later initial state observations replace earlier ones
+    retained = last | (key % cohort_dim != 0)
+    order = order[retained]
+    key = key[retained]
+    start = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.zeros(0, dtype=int)
+
+    return EventIndex(entity_ids, key[start] // cohort_dim, key[start] % cohort_dim, np.append(start, len(key)),
+                      event_time[order], event_state[order], cohort_bounds)
+
+
 def generate_event_dict(data, dt, cohort_bounds):
     """
-    Loop over all events and construct a dictionary in the following format:
+    Assign all events to cohort intervals and construct a dictionary in the following format:
 
     .. code::
 
@@ -170,40 +456,15 @@ def generate_event_dict(data, dt, cohort_bounds):
 
     This data structure allows applying arbitrary state assignment to each cohort interval
 
+    .. note:: The dictionary is constructed from the (more memory efficient) EventIndex, see generate_event_index
+
     :param data: a pandas dataframe
     :param dt: the cohort interval
     :param cohort_bounds: the boundaries of the cohort intervals
     :return: dict
 
     """
-
-    initial_time = cohort_bounds[0]
-
-    event_dict = {}
-    for row in data.itertuples():
-
-        entity_id = row.ID
-        event_time = row.Time
-        entity_state = row.State
-
-        # insert initial state observation events
-        # ATTN equality check
-        if event_time == initial_time:
-            event_key = (entity_id, 0)
-            event_dict[event_key] = [(event_time, entity_state)]
-        else:
-            # Find the interval of the event (the cohort it belongs it)
-            c = 0
-            for i in range(len(cohort_bounds)):
-                if event_time > cohort_bounds[i]:
-                    c = i
-            event_key = (entity_id, c + 1)
-            if event_key in event_dict.keys():  # append observation if (i, c) key exists
-                event_dict[event_key].append((event_time, entity_state))
-            else:  # create new key if (i, c) key does not exist
-                event_dict[event_key] = [(event_time, entity_state)]
-
-    return event_dict
+    return generate_event_index(data, cohort_bounds).to_dict()
 
 
 def remove_stale_events(data):
@@ -217,28 +478,84 @@ def remove_stale_events(data):
           (entity_id, cohort interval) : (time, state), ..., (time, state)]
         }
 
-    :param data: a pandas dataframe
+    The states of all event lists are compared at once (each event is compared with its successor in the list)
+
+    :param data: an event dictionary
     :return: dict
 
     """
-    event_dict = {}
-    for event_key in data.keys():
-        # Pull the list of all events for this entity in this time
-        event_list = data[event_key]
-        new_event_list = []
-        # Iterate over all events and only keep those leading to changed state
-        for i in range(len(event_list) - 1):
-            if event_list[i][1] != event_list[i + 1][1]:
-                new_event_list.append(event_list[i])
-        # Last event added by default
-        i = len(event_list) - 1
-        new_event_list.append(event_list[i])
-        event_dict[event_key] = new_event_list
-
-    return event_dict
-
-
-def bin_timestamps(sorted_data, cohorts, output_format=0, remove_stale=False):
+    events = list(itertools.chain.from_iterable(data.values()))
+    offsets = np.concatenate(([0], np.cumsum([len(event_list) for event_list in data.values()], dtype=int)))
+    states = np.empty(len(events), dtype=object)
+    states[:] = [event[1] for event in events]
+    # Only keep events leading to changed state, the last event of each list is added by default
+    keep = np.zeros(len(events), dtype=bool)
+    keep[offsets[1:] - 1] = True
+    keep[:-1] |= states[:-1] != states[1:]
+    kept_events = list(itertools.compress(events, keep))
+    kept_offsets = np.concatenate(([0], np.cumsum(keep)))[offsets].tolist()
+
+    return {event_key: kept_events[kept_offsets[k]:kept_offsets[k + 1]] for k, event_key in enumerate(data.keys())}
+
+
+def stale_observations(entity_id, entity_state):
+    """
+    Flag the observations that repeat the state of the previous observation of the same entity
+
+    :param entity_id: array of entity identifiers (sorted by ID and Time)
+    :param entity_state: array of observed states
+    :return: boolean array
+
+    .. note:: Missing states are never stale
+
+    """
+    entity_id = np.asarray(entity_id)
+    entity_state = np.asarray(entity_state)
+    stale = np.zeros(len(entity_id), dtype=bool)
+    stale[1:] = (entity_id[1:] == entity_id[:-1]) & (entity_state[1:] == entity_state[:-1])
+    return stale
+
+
+def compress_stale_observations(data, labels=None, keep='first'):
+    """
+    Remove repeated observations of unchanged states (e.g. periodic snapshots of a sticky state space) from
+    timestamped data in compact format (one row per observation)
+
+    * keep='first': retain the first observation of each run of the same state and the last observation of each entity (the end of its observation period). The states at all times, hence the time at risk per state and the transitions between observations, are unchanged
+    * keep='last': retain the last observation of each run of the same state (as in remove_stale_events)
+
+    :param data: the dataframe to compress (sorted by ID and Time)
+    :param labels: an optional dictionary for relabeling column names (ID, State)
+    :param keep: the retained observation of each run ('first' or 'last')
+    :type keep: str
+
+    :returns: the compressed dataframe and the compression ratio (number of rows before / after compression)
+
+    .. warning:: Cohort data (the state of each entity at each cohort bound, see bin_timestamps) must not be compressed
+
+    """
+    if labels is None:
+        labels = {}
+    entity_id = data[labels.get('ID', 'ID')].to_numpy()
+    entity_state = data[labels.get('State', 'State')].to_numpy()
+    stale = stale_observations(entity_id, entity_state)
+    last = np.ones(len(entity_id), dtype=bool)
+    last[:-1] = entity_id[1:] != entity_id[:-1]
+    if keep == 'first':
+        retained = ~stale | last
+    elif keep == 'last':
+        retained = np.ones(len(entity_id), dtype=bool)
+        retained[:-1] = ~stale[1:]
+    else:
+        raise ValueError("keep must be 'first' or 'last'")
+
+    compressed = data[retained]
+    compression_ratio = len(data) / len(compressed) if len(compressed) else 1.0
+    return compressed, compression_ratio
+
+
+def bin_timestamps(sorted_data, cohorts, output_format=0, remove_stale=False, reducer='last', order=None,
+                   full_labels=False):
     """
     Bin timestamped data in a dataframe so as to have ingoing and outgoing states per cohort interval
 
@@ -246,6 +563,9 @@ def bin_timestamps(sorted_data, cohorts, output_format=0, remove_stale=False):
     :param cohorts: the number of cohorts
     :param output_format: how to structure the outputs (0=cohorts, 1=event_list)
     :param remove_stale: whether to remove successive observations with identical state
+    :param reducer: how to assign a state to each cohort interval from the observations in the interval (see EventIndex.reduce)
+    :param order: the states ordered from best to worst (for the 'worst' reducer with non numeric states)
+    :param full_labels: keep the full state labels with the default reducer (see the note below)
     :type data: pandas dataframe
     :type dimension: int
     :type output_format: int
@@ -255,6 +575,8 @@ def bin_timestamps(sorted_data, cohorts, output_format=0, remove_stale=False):
 
     .. note:: The 'ID' and 'Time' column labels are used by default.
 
+    .. note:: For backwards compatibility the default reducer ('last' without an order) truncates state labels to their first character (e.g. 'AAA' to 'A') unless full_labels is set. All other reducers keep the full state labels.
+
     .. warning:: Cohorting is a 'lossy' operation: Timestamps are discretised (binned) and any intermediate state transitions are lost.
 
     .. warning:: The data must be sorted already
@@ -273,117 +595,69 @@ def bin_timestamps(sorted_data, cohorts, output_format=0, remove_stale=False):
     # dt = 1.0
     # cohort_bounds = [0.0, 1.0]
 
-    # Identify unique entities in the frame
-    unique_ids = sorted_data['ID'].unique()
-
-    # Array storage for processed data
-    cohort_assigned_state = np.empty((len(unique_ids), len(cohort_bounds)), str)
-    cohort_assigned_state.fill(np.nan)
-    cohort_event = np.empty((len(unique_ids), len(cohort_bounds)))
-    cohort_event.fill(np.nan)
-    cohort_count = np.empty((len(unique_ids), len(cohort_bounds)))
-    cohort_count.fill(np.nan)
-
     # STEP 2
-    # Generate the full event dictionary
+    # Generate the index of the events of each entity / cohort interval pair
     #
-    event_dict = generate_event_dict(sorted_data, dt, cohort_bounds)
-
-    # pp.pprint(event_dict)
-
+    event_index = generate_event_index(sorted_data, cohort_bounds)
     if remove_stale:
-        event_dict = remove_stale_events(event_dict)
+        event_index = event_index.remove_stale()
+
+    if output_format == 1:
+        return event_index.to_dict(), cohort_bounds
+    elif output_format != 0:
+        return None
 
     # STEP 3
-    # Loop over all possible entity / cohort interval pairs
-    # assign a state to the cohort interval
-    # compute counts of events within cohort inteval
-    # ATTN we loop over all possibilities, not all actual realizations.
-    # We use integer indexes for entities / cohort intervals
-
-    for id in unique_ids:
-        for time in range(len(cohort_bounds)):
-
-            # Construct the event key
-            entity_id = list(unique_ids).index(id)
-            event_key = (id, time)
-            # Intervals are associated with bounds starting at 0
-            # 0 Interval between 0 and 1 Timestep
-            # 1 Interval between 1 and 2 Timestep etc.
-
-            interval = time
-
-            # Case A: We have events for the entity in this time
-            # (If the key exists there should be at least one event for this entity in this time)
-            if event_key in event_dict.keys():
-
-                # Pull the list of all events for this entity in this time
-                event_list = event_dict[(id, interval)]
-
-                # Assign state to cohort
-                # Here we are using the LAST observation in interval
-                # TODO Generalize to user specified function (first observation, average state in interval etc)
-                if time == 0:
-                    # The first time point is a special (initial state)
-                    cohort_assigned_state[entity_id, time] = event_list[0][1]  # the initial state
-                    cohort_event[entity_id, time] = event_list[0][0]  # the actual time of the initial state
-                    cohort_count[entity_id, time] = 1  # by default only one count at initial state
-                    #
-                    # # Assign to the first cohort interval the last observed state
-                    # cohort_assigned_state[entity_id, time + 1] = event_list[len(event_list) - 1][1]
-                    # # Pick time of last event (informative)
-                    # cohort_event[entity_id, time + 1] = event_list[len(event_list) - 1][0]
-                    # # Add the count of events for that entity in the cohort (informative)
-                    # cohort_count[entity_id, time + 1] = int(len(event_list))
-
-                    # print('A00', event_key, time, cohort_event[entity_id, time])
-                    # print('A01', event_key, time, cohort_event[entity_id, time + 1])
-                else:
-                    # Assign to the cohort interval the last observed state
-                    cohort_assigned_state[entity_id, time] = event_list[len(event_list) - 1][1]
-                    # Pick time of last event (informative)
-                    cohort_event[entity_id, time] = event_list[len(event_list) - 1][0]
-                    # Add the count of events for that entity in the cohort (informative)
-                    cohort_count[entity_id, time] = int(len(event_list))
-
-                    # print('AXX', event_key, time, cohort_assigned_state[entity_id, time])
-
-            # Case B: We don't have events for the entity in this interval and it is the first interval
-            # If we don't have observation for an entity in the first interval we assign NaN state
-            elif event_key not in event_dict.keys() and time == 0:
-
-                cohort_assigned_state[entity_id, time] = np.nan
-                cohort_event[entity_id, time] = np.nan
-                cohort_count[entity_id, time] = np.nan
-
-                # print('BXX', event_key, time, cohort_count[entity_id, time])
-
-            # Case C: We don't have events for the entity in this interval but maybe we have in the previous one
-            # if there are no events and the previous state is available assign the last known state, else NaN
-            elif event_key not in event_dict.keys() and time > 0:
-
-                if cohort_assigned_state[entity_id, time - 1]:
-                    cohort_assigned_state[entity_id, time] = cohort_assigned_state[entity_id, time - 1]
-                    cohort_event[entity_id, time] = cohort_event[entity_id, time - 1]
-                    cohort_count[entity_id, time] = cohort_count[entity_id, time - 1]
-                else:
-                    cohort_assigned_state[entity_id, time] = np.nan
-                    cohort_event[entity_id, time] = np.nan
-                    cohort_count[entity_id, time] = np.nan
-
-                # print('CXX', event_key, time, cohort_count[entity_id, time])
+    # Assign a state to the cohort interval with the reducer (by default the LAST observation in the interval)
+    # Compute counts of events within cohort interval
+    # Events beyond the last bound (rounding of the bounds) are not assigned to a cohort interval
+    #
+    cohort_dim = len(cohort_bounds)
+    entity_count = len(event_index.entity_ids)
+    assigned = event_index.cohort < cohort_dim
+    observed = (event_index.entity * cohort_dim + event_index.cohort)[assigned]
+
+    # States are stored as strings. The default (last observation) assignment keeps the legacy single character
+    # strings (missing states as 'n'), other reducers (or full_labels) use strings wide enough for the state labels
+    assigned_state = event_index.reduce(reducer, order=order)[assigned]
+    if reducer == 'last' and order is None and not full_labels:
+        state_dtype = str
+    else:
+        assigned_state = assigned_state.astype(str)
+        state_dtype = np.result_type('<U1', assigned_state.dtype)
+    cohort_assigned_state = np.empty(entity_count * cohort_dim, state_dtype)
+    cohort_assigned_state.fill(np.nan)
+    cohort_event = np.full(entity_count * cohort_dim, np.nan)
+    cohort_count = np.full(entity_count * cohort_dim, np.nan)
+    cohort_assigned_state[observed] = assigned_state.astype(state_dtype)
+    cohort_event[observed] = event_index.reduce('last', values='times')[assigned]
+    cohort_count[observed] = event_index.reduce('count')[assigned]
+
+    # STEP 4
+    # Intervals without events carry the last known state (and its event time and count) forward
+    # The first interval without observation has a NaN state. A missing (empty) previous state resets to NaN
+    #
+    has_events = np.zeros(entity_count * cohort_dim, dtype=bool)
+    has_events[observed] = True
+    has_events = has_events.reshape((entity_count, cohort_dim))
+    has_events[:, 0] = True
+    position = np.where(has_events, np.arange(cohort_dim), 0)
+    source = np.maximum.accumulate(position, axis=1) + np.arange(entity_count)[:, np.newaxis] * cohort_dim
+    source = source.ravel()
+    cohort_assigned_state = cohort_assigned_state[source]
+    cohort_event = cohort_event[source]
+    cohort_count = cohort_count[source]
+    reset = ~has_events.ravel() & (cohort_assigned_state == '')
+    cohort_assigned_state[reset] = np.nan
+    cohort_event[reset] = np.nan
+    cohort_count[reset] = np.nan
 
     # Convert to pandas dataframe
-    cohort_data = []
-    for i in range(len(unique_ids)):
-        for c in range(len(cohort_bounds)):
-            cohort_data.append((unique_ids[i], c, cohort_assigned_state[i][c], cohort_event[i][c], cohort_count[i][c]))
-
     # The time index spans the cohort intervals (bounds - 1)
-    # The measurement time point is the
-    cohort_data = pd.DataFrame(cohort_data, columns=['ID', 'Time', 'State', 'EventTime', 'Count'])
+    cohort_data = pd.DataFrame({'ID': np.repeat(np.asarray(event_index.entity_ids), cohort_dim),
+                                'Time': np.tile(np.arange(cohort_dim), entity_count),
+                                'State': cohort_assigned_state.astype(object),
+                                'EventTime': cohort_event,
+                                'Count': cohort_count})
 
-    if output_format == 0:
-        return cohort_data, cohort_bounds
-    elif output_format == 1:
-        return event_dict, cohort_bounds
+    return cohort_data, cohort_bounds
@@ -0,0 +1,130 @@
+# encoding: utf-8
+
+# (c) 2017-2024 Open Risk, all rights reserved
+#
+# TransitionMatrix is licensed under the Apache 2.0 license a copy of which is included
+# in the source distribution of TransitionMatrix. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Dataset profiling: summary statistics of transition datasets computed in a single sweep over the columns
+
+Profiles are cached (in memory) by the content hash of the dataset, hence repeated profiling of an unchanged
+dataset (e.g. by different estimators or reports) is a lookup.
+
+"""
+
+from __future__ import print_function, division
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# the number of cached dataset profiles
+PROFILE_CACHE_SIZE = 32
+
+_profile_cache = OrderedDict()
+
+
+def dataset_fingerprint(data):
+    """
+    Fast content hash of a dataframe (values, column names and types)
+
+    :param data: pandas dataframe
+    :returns: hexadecimal digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr([(str(c), str(t)) for c, t in data.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _summary(values):
+    """ Minimum, mean and maximum of an array (None if empty) """
+    if len(values) == 0:
+        return None
+    return {'min': values.min(), 'mean': values.mean(), 'max': values.max()}
+
+
+def dataset_profile(data, labels=None, cache=True):
+    """
+    Profile a transition dataset (compact or canonical format). Each column is scanned once:
+
+    * rows: the number of rows
+    * unique_entities, events_per_entity (min, mean, max)
+    * unique_states, state_counts (observations per state, the From column for canonical data), missing_states
+    * unique_timestamps, total_timestamps (non missing), period_counts (observations per timestamp), time_range
+    * event_gaps (min, mean, max time between successive observations of the same entity)
+    * sorted (by ID and Time), sorted_by_time (by Time only)
+    * fingerprint: the content hash of the dataset
+
+    Statistics of missing columns are not part of the profile
+
+    :param data: the dataframe to profile
+    :param labels: an optional dictionary for relabeling column names (ID, Time, State or From)
+    :param cache: use (and store) the cached profile of the dataset
+    :type cache: bool
+
+    :returns: dict
+
+    .. note:: Cached profiles are shared, they should not be modified
+
+    """
+    if labels is None:
+        labels = {}
+    fingerprint = dataset_fingerprint(data)
+    key = (fingerprint, tuple(sorted(labels.items())))
+    if cache and key in _profile_cache:
+        _profile_cache.move_to_end(key)
+        return _profile_cache[key]
+
+    id_label = labels.get('ID', 'ID')
+    time_label = labels.get('Time', 'Time')
+    state_label = labels.get('State', 'State')
+    if state_label not in data.columns:
+        state_label = labels.get('From', 'From')
+
+    profile = {'rows': len(data), 'fingerprint': fingerprint}
+    entity_index = None
+    if id_label in data.columns:
+        entity_index, entities = pd.factorize(data[id_label], use_na_sentinel=False)
+        profile['unique_entities'] = len(entities)
+        profile['events_per_entity'] = _summary(np.bincount(entity_index))
+
+    if state_label in data.columns:
+        state_index, states = pd.factorize(data[state_label], use_na_sentinel=False)
+        profile['unique_states'] = len(states)
+        profile['state_counts'] = pd.Series(np.bincount(state_index, minlength=len(states)), index=states)
+        profile['missing_states'] = int(profile['state_counts'][pd.isna(states)].sum())
+
+    if time_label in data.columns:
+        times = data[time_label]
+        valid = times.notna().to_numpy()
+        profile['total_timestamps'] = int(valid.sum())
+        period_counts = times.value_counts(sort=False).sort_index()
+        profile['period_counts'] = period_counts
+        profile['unique_timestamps'] = len(period_counts) + int(not valid.all())
+        profile['time_range'] = (period_counts.index[0], period_counts.index[-1]) if len(period_counts) else None
+        profile['sorted_by_time'] = bool(times.is_monotonic_increasing)
+
+        if entity_index is not None:
+            values = times.to_numpy()
+            same_entity = entity_index[1:] == entity_index[:-1]
+            if values.dtype.kind in 'iufmM':
+                gaps = (values[1:] - values[:-1])[same_entity & valid[1:] & valid[:-1]]
+                profile['event_gaps'] = _summary(gaps)
+                in_order = gaps >= gaps.dtype.type(0)
+                profile['sorted'] = bool(data[id_label].is_monotonic_increasing and in_order.all())
+
+    if cache:
+        _profile_cache[key] = profile
+        while len(_profile_cache) > PROFILE_CACHE_SIZE:
+            _profile_cache.popitem(last=False)
+    return profile